@@ -1,23 +1,125 @@
 from contextlib import closing
 from collections import deque
 import errno
-from eventlet import Timeout, spawn_n, event
+import hashlib
+import heapq
+import itertools
+from eventlet import Timeout, spawn_n, event, sleep
+from eventlet.queue import Queue
 
 from kinetic import AsyncClient
+from kinetic import operations
+from kinetic.common import Priority, IntegrityAlgorithms
 import datetime
+import time
+
+
+DEFAULT_PREFETCH = 1
+DEFAULT_MIN_KEY_RANGE = 25
+DEFAULT_MAX_KEY_RANGE = 200
+DEFAULT_MANY_DEPTH = 16
+# Kinetic's default maxOperationCountPerBatch
+DEFAULT_BATCH_MAX_OPS = 15
+# batches in flight, kept under Kinetic's default maxBatchCountPerDevice
+DEFAULT_BATCH_DEPTH = 4
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_PROBE_INTERVAL = 1.0
+DEFAULT_BREAKER_MAX_PROBE_INTERVAL = 30.0
+# kinetic's green client holds back requests beyond 10 pending on a
+# connection, past that they're queued here in priority order instead
+DEFAULT_MAX_IN_FLIGHT = 10
+
+# priority classes for config options, drives run higher priority commands
+# first; identities are only allowed up to normal by default
+PRIORITY_CLASSES = {
+    'lowest': Priority.LOWEST,
+    'lower': Priority.LOWER,
+    'normal': Priority.NORMAL,
+    'higher': Priority.HIGHER,
+    'highest': Priority.HIGHEST,
+}
+
+
+def parse_priority(value):
+    """
+    :param value: the name of a priority class, e.g. lower
+    :returns: the Kinetic Priority
+    """
+    try:
+        return PRIORITY_CLASSES[value.lower()]
+    except KeyError:
+        raise ValueError('Invalid priority %r, choices are %r' % (
+            value, sorted(PRIORITY_CLASSES)))
+
+
+def integrity_kwargs(data, kwargs):
+    """
+    Tag a value kinetic won't tag itself.
+
+    kinetic computes the SHA1 tag of str, bytes and bytearray values, but
+    anything else (like a memoryview of an upload buffer) is sent with a
+    placeholder tag, so the tag is computed here without copying the value.
+
+    :param data: the value of a put
+    :param kwargs: the put's kwargs
+
+    :returns: the kwargs, with a tag and algorithm if data needs them
+    """
+    if not data or 'tag' in kwargs or isinstance(data, (str, bytearray)):
+        return kwargs
+    return dict(kwargs, tag=hashlib.sha1(data).digest(),
+                algorithm=IntegrityAlgorithms.SHA1)
 
 
 class Response(object):
 
-    def __init__(self, client):
+    def __init__(self, client, size=0, op_class=None):
         self.resp = event.Event()
         self._hasError = False
+        # set once the request's accounting has been released
+        self._finished = False
         self.client = client
+        self.client.outstanding += 1
+        self.client.responses.add(self)
+        self.size = size
+        # read, write or delete, picks the depth controller that's told how
+        # long the request took
+        self.op_class = op_class
+        # set once the request is on the wire, see KineticSwiftClient._send
+        self.dispatched = False
+        if self.client.admission:
+            self.client.admission.start(size)
+        self.sent = time.time()
+
+    def _done(self, observe=True):
+        """
+        Release the request's accounting, only the first call counts.
+
+        :param observe: tell the depth controller how long it took
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self.client.outstanding -= 1
+        self.client.responses.discard(self)
+        if self.dispatched:
+            self.client._landed()
+        if self.client.admission:
+            self.client.admission.finish(self.size)
+        controller = self.client.depth_controllers.get(self.op_class)
+        if observe and controller:
+            controller.observe(time.time() - self.sent)
 
     def setResponse(self, v):
+        if self.resp.ready():
+            return
+        self._done()
         self.resp.send(v)
 
     def setError(self, e):
+        if self.resp.ready():
+            return
+        self._done()
         self._hasError = True
         self.resp.send(e)
 
@@ -39,20 +141,198 @@ class Response(object):
                         self.client.close()
                     raise
         except Timeout:
+            # the answer isn't coming, the connection is closed and nothing
+            # calls back for the requests that were pending on it
+            self._done(observe=False)
+            controller = self.client.depth_controllers.get(self.op_class)
+            if controller:
+                controller.decrease()
             spawn_n(self.client.close)
             raise Exception('Timeout (%ss) getting response from Drive %s:%s' %
                             (self.client.response_timeout,
                              self.client.host, self.client.port))
 
 
+class SingleFlight(object):
+    """
+    The reads in flight to one drive, so that identical concurrent reads
+    can share a single command and Response instead of each asking the
+    drive for the same thing.
+
+    :param logger: a swift LogAdapter
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.in_flight = {}
+        self.leaders = self.coalesced = 0
+
+    def join(self, key):
+        """
+        :returns: the Response of the read in flight for key, or None
+        """
+        promise = self.in_flight.get(key)
+        if promise is None:
+            return None
+        client = promise.client
+        if client.faulted or \
+                time.time() - promise.sent > client.response_timeout:
+            # the leader is never going to hear back
+            self.forget(key)
+            return None
+        self.coalesced += 1
+        self.logger.increment('single_flight.coalesced')
+        return promise
+
+    def lead(self, key, promise):
+        self.in_flight[key] = promise
+        self.leaders += 1
+        self.logger.increment('single_flight.leader')
+
+    def land(self, key, promise):
+        if self.in_flight.get(key) is promise:
+            del self.in_flight[key]
+
+    def forget(self, key):
+        """
+        Stop handing out the read in flight for key, e.g. because the value
+        it will return has been replaced.
+        """
+        self.in_flight.pop(key, None)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stop connecting to a drive that keeps refusing connections.
+
+    The breaker starts closed and lets connects through.  After threshold
+    connects in a row fail it opens, and every connect fails fast with
+    CircuitOpen while a background prober retries the drive, starting
+    probe_interval seconds apart and backing off to max_probe_interval.
+    While a probe is running the breaker is half open (and still fails
+    fast), a probe that succeeds closes it again.
+
+    :param name: the drive (host:port), used in log messages
+    :param logger: a swift LogAdapter
+    :param probe: a callable that connects to the drive, raises on error
+    :param threshold: consecutive failures before the breaker opens
+    :param probe_interval: seconds before the first probe
+    :param max_probe_interval: the most seconds between probes
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, logger, probe,
+                 threshold=DEFAULT_BREAKER_THRESHOLD,
+                 probe_interval=DEFAULT_BREAKER_PROBE_INTERVAL,
+                 max_probe_interval=DEFAULT_BREAKER_MAX_PROBE_INTERVAL):
+        self.name = name
+        self.logger = logger
+        self.probe = probe
+        self.threshold = max(1, threshold)
+        self.probe_interval = probe_interval
+        self.max_probe_interval = max(probe_interval, max_probe_interval)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        self.logger.warning('Drive %s circuit %s -> %s' % (
+            self.name, self.state, state))
+        self.state = state
+        self.logger.increment('circuit_breaker.%s' % state)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func (a connect) unless the breaker is open.
+
+        :raises CircuitOpen: if the breaker isn't closed
+        """
+        if self.state != self.CLOSED:
+            self.rejected += 1
+            self.logger.increment('circuit_breaker.rejected')
+            raise CircuitOpen('Drive %s circuit is %s' % (
+                self.name, self.state))
+        try:
+            resp = func(*args, **kwargs)
+        except (Exception, Timeout):
+            self.failure()
+            raise
+        self.failures = 0
+        return resp
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.CLOSED and self.failures >= self.threshold:
+            self._transition(self.OPEN)
+            spawn_n(self._run_prober)
+
+    def _run_prober(self):
+        interval = self.probe_interval
+        while self.state != self.CLOSED:
+            sleep(interval)
+            self._transition(self.HALF_OPEN)
+            try:
+                self.probe()
+            except (Exception, Timeout) as e:
+                self.logger.debug('Drive %s probe failed: %s' % (
+                    self.name, e))
+                self._transition(self.OPEN)
+                interval = min(self.max_probe_interval, interval * 2)
+            else:
+                self.failures = 0
+                self._transition(self.CLOSED)
+
+
 class KineticSwiftClient(object):
 
     def __init__(self, logger, host, port, **kwargs):
-        self.maxReturned = None  # use library default
+        self.maxReturned = None  # adaptive page sizes
+        # bounds for adaptive key range pages
+        self.min_key_range = DEFAULT_MIN_KEY_RANGE
+        self.max_key_range = DEFAULT_MAX_KEY_RANGE
+        # how many key range pages to read ahead of the caller
+        self.prefetch = kwargs.pop('prefetch', DEFAULT_PREFETCH)
+        # the most operations in a batch, less than 2 disables batching
+        self.batch_max_ops = kwargs.pop('batch_max_ops', DEFAULT_BATCH_MAX_OPS)
+        # the most batches in flight
+        self.batch_depth = kwargs.pop('batch_depth', DEFAULT_BATCH_DEPTH)
+        # the Kinetic priority of requests that don't ask for one
+        self.priority = kwargs.pop('priority', Priority.NORMAL)
+        # the most requests on the wire, the rest wait in a local queue
+        # ordered by priority, 0 for no limit
+        self.max_in_flight = kwargs.pop('max_in_flight',
+                                        DEFAULT_MAX_IN_FLIGHT)
+        self.in_flight = 0
+        self._queue = []
+        self._sequence = itertools.count()
         self.host = self.hostname = host
         self.port = port
         self.response_timeout = kwargs.pop('response_timeout', 30)
         self.logger = logger
+        # number of Response promises that have not been answered yet
+        self.outstanding = 0
+        # ... and the promises, they're failed if the connection is closed
+        self.responses = set()
+        # optional objects with observe(latency) and decrease() methods by
+        # op class (read, write or delete) that get told how long each
+        # response of that class took
+        self.depth_controllers = {}
+        # optional SingleFlight shared by the clients of a drive
+        self.single_flight = None
+        # optional GroupCommit shared by the clients of a drive
+        self.group_commit = None
+        # optional object with start(size) and finish(size) methods shared
+        # by the clients of a drive that's told about every request
+        self.admission = None
         self.conn = AsyncClient(host, port, **kwargs)
         self.conn.connect()
 
@@ -76,6 +356,12 @@ class KineticSwiftClient(object):
         self.logger.info('Forced shutdown to %s:%s' % (
             self.hostname, self.port))
         self.conn = None
+        # the queued requests are never going to be sent, and the ones on
+        # the wire are never going to be answered
+        self._queue = []
+        for promise in list(self.responses):
+            promise.setError(Exception('Connection to Drive %s:%s closed' % (
+                self.host, self.port)))
 
     @property
     def isConnected(self):
@@ -87,62 +373,221 @@ class KineticSwiftClient(object):
             return True
         return self.conn.faulted
 
+    def window(self, depth, op_class):
+        """
+        The number of requests of an op class to keep in flight, the
+        drive's adaptive window for it if there is one, bounded by depth.
+        """
+        controller = self.depth_controllers.get(op_class)
+        if not controller:
+            return depth
+        return controller.bound(depth)
+
     def reconnect(self):
         self.conn.close()
         self.conn.faulted = False
         self.conn.connect()
 
-    def getPrevious(self, *args, **kwargs):
-        # self.log_info('getPrevious')
-        promise = Response(self)
-        self.conn.getPreviousAsync(promise.setResponse, promise.setError,
-                                   *args, **kwargs)
+    def _send(self, promise, kwargs, bulk, send):
+        """
+        Send a request now, or if max_in_flight requests are already on the
+        wire queue it.  The queue is drained highest priority first, and
+        within a priority metadata requests go ahead of bulk transfers of
+        values.
+
+        :param promise: the request's Response
+        :param kwargs: the request's kwargs, the client's priority is
+                       filled in if there isn't one
+        :param bulk: True if the request carries a value
+        :param send: a callable that puts the request on the wire
+        """
+        priority = kwargs.setdefault('priority', self.priority)
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            rank = (-priority, bulk, next(self._sequence))
+            heapq.heappush(self._queue, (rank, promise, send))
+            return
+        self._dispatch(promise, send)
+
+    def _dispatch(self, promise, send):
+        self.in_flight += 1
+        promise.dispatched = True
+        promise.sent = time.time()
+        try:
+            send()
+        except Exception:
+            if not promise.ready():
+                promise.dispatched = False
+                self.in_flight -= 1
+            raise
+
+    def _landed(self):
+        self.in_flight -= 1
+        while self._queue and self.in_flight < self.max_in_flight:
+            _rank, promise, send = heapq.heappop(self._queue)
+            try:
+                self._dispatch(promise, send)
+            except Exception as e:
+                if not promise.ready():
+                    promise.setError(e)
+
+    def _read(self, op, method, key, *args, **kwargs):
+        """
+        Send a read, joining an identical one if it's already in flight.
+
+        :param op: the name of the read, e.g. get
+        :param method: the AsyncClient method that sends it
+        :param key: the key to read
+        """
+        flight = self.single_flight
+        bulk = op == 'get'
+        if flight is None or args or set(kwargs) - set(['priority']):
+            promise = Response(self, op_class='read')
+            self._send(promise, kwargs, bulk, lambda: method(
+                promise.setResponse, promise.setError, key, *args,
+                **kwargs))
+            return promise
+        flight_key = (op, key)
+        promise = flight.join(flight_key)
+        if promise is not None:
+            return promise
+        promise = Response(self, op_class='read')
+
+        def on_response(resp):
+            flight.land(flight_key, promise)
+            promise.setResponse(resp)
+
+        def on_error(e):
+            flight.land(flight_key, promise)
+            promise.setError(e)
+
+        flight.lead(flight_key, promise)
+        try:
+            self._send(promise, kwargs, bulk, lambda: method(
+                on_response, on_error, key, **kwargs))
+        except Exception:
+            flight.land(flight_key, promise)
+            raise
         return promise
 
+    def getPrevious(self, key, *args, **kwargs):
+        # self.log_info('getPrevious')
+        return self._read('getPrevious', self.conn.getPreviousAsync, key,
+                          *args, **kwargs)
+
     def put(self, key, data, *args, **kwargs):
         # self.log_info('put')
-        promise = Response(self)
-        self.conn.putAsync(promise.setResponse, promise.setError, key, data,
-                           *args, **kwargs)
+        promise = Response(self, size=len(data), op_class='write')
+        kwargs = integrity_kwargs(data, kwargs)
+        self._send(promise, kwargs, True, lambda: self.conn.putAsync(
+            promise.setResponse, promise.setError, key, data, *args,
+            **kwargs))
         return promise
 
     def getKeyRange(self, *args, **kwargs):
         # self.log_info('getKeyRange')
-        promise = Response(self)
-        self.conn.getKeyRangeAsync(promise.setResponse, promise.setError,
-                                   *args, **kwargs)
+        promise = Response(self, op_class='read')
+        self._send(promise, kwargs, False, lambda: self.conn.getKeyRangeAsync(
+            promise.setResponse, promise.setError, *args, **kwargs))
         return promise
 
-    def iterKeyRange(self, start_key, end_key, **kwargs):
+    def iterKeyRange(self, start_key, end_key, prefetch=None, **kwargs):
+        """
+        Iterate over all of the keys in a range, paging with getKeyRange.
+
+        The request for the next page is sent as soon as the previous page
+        arrives, up to prefetch pages ahead of the caller.  Unless a
+        maxReturned is given (or set on the client) page sizes start at
+        min_key_range and double while pages come back full, up to
+        max_key_range.
+
+        :param start_key: the first key in the range
+        :param end_key: the last key in the range
+        :param prefetch: override the client's read-ahead page count
+        """
+        if prefetch is None:
+            prefetch = self.prefetch
         if 'maxReturned' not in kwargs and self.maxReturned is not None:
             kwargs['maxReturned'] = self.maxReturned
-        keys = self.getKeyRange(start_key, end_key, **kwargs).wait()
-        while keys:
+        adaptive = 'maxReturned' not in kwargs
+        reverse = kwargs.get('reverse', False)
+        pages = deque()
+        state = {
+            'start_key': start_key,
+            'end_key': end_key,
+            'first': True,
+            'size': kwargs.get('maxReturned', self.min_key_range),
+            'in_flight': False,
+            'done': False,
+        }
+
+        def fetch():
+            state['in_flight'] = True
+            page_kwargs = dict(kwargs, maxReturned=state['size'])
+            if not state['first']:
+                page_kwargs.update(startKeyInclusive=False,
+                                   endKeyInclusive=False)
+            state['first'] = False
+            promise = Response(self, op_class='read')
+
+            def on_page(keys):
+                if not keys:
+                    state['done'] = True
+                else:
+                    # see if there's any more values
+                    if reverse:
+                        state['end_key'] = keys[-1]
+                    else:
+                        state['start_key'] = keys[-1]
+                    if adaptive and len(keys) >= state['size']:
+                        state['size'] = min(self.max_key_range,
+                                            state['size'] * 2)
+                state['in_flight'] = False
+                promise.setResponse(keys)
+                if not state['done'] and len(pages) < prefetch:
+                    fetch()
+
+            def on_error(e):
+                state['in_flight'] = False
+                state['done'] = True
+                promise.setError(e)
+
+            pages.append(promise)
+            start, end = state['start_key'], state['end_key']
+            self._send(promise, page_kwargs, False,
+                       lambda: self.conn.getKeyRangeAsync(
+                           on_page, on_error, start, end, **page_kwargs))
+
+        def can_fetch():
+            return not (state['done'] or state['in_flight'])
+
+        fetch()
+        while pages:
+            keys = pages.popleft().wait()
+            if prefetch and len(pages) < prefetch and can_fetch():
+                fetch()
             for key in keys:
                 yield key
-            # see if there's any more values
-            if kwargs.get('reverse', False):
-                end_key = key
-            else:
-                start_key = key
-            keys = self.getKeyRange(start_key, end_key,
-                                    startKeyInclusive=False,
-                                    endKeyInclusive=False,
-                                    **kwargs).wait()
+            if not pages and can_fetch():
+                fetch()
 
     def delete(self, key, *args, **kwargs):
         # self.log_info('delete')
+        promise = Response(self, op_class='delete')
+        self._send(promise, kwargs, False, lambda: self.conn.deleteAsync(
+            promise.setResponse, promise.setError, key, *args, **kwargs))
+        return promise
+
+    def flush(self, *args, **kwargs):
+        # self.log_info('flush')
         promise = Response(self)
-        self.conn.deleteAsync(promise.setResponse, promise.setError, key,
-                              *args, **kwargs)
+        self._send(promise, kwargs, False, lambda: self.conn.flushAsync(
+            promise.setResponse, promise.setError, *args, **kwargs))
         return promise
 
     def get(self, key, *args, **kwargs):
         # self.log_info('get')
-        promise = Response(self)
-        self.conn.getAsync(promise.setResponse, promise.setError, key,
-                           *args, **kwargs)
-        return promise
+        return self._read('get', self.conn.getAsync, key, *args,
+                          **kwargs)
 
     def raise_err(self, *args, **kwargs):
         raise Exception(
@@ -150,48 +595,249 @@ class KineticSwiftClient(object):
                 self.host, self.port, args, kwargs))
 
     def rename(self, key, new_key):
-        promise = Response(self)
+        promise = Response(self, op_class='write')
 
-        def delete_key(*args, **kwargs):
-            self.conn.deleteAsync(promise.setResponse, promise.setError, key,
-                                  *args, **kwargs)
+        def delete_key(*args):
+            self.conn.deleteAsync(promise.setResponse, promise.setError, key)
 
         def write_entry(entry):
             if not entry:
                 delete_key()
             else:
-                self.conn.putAsync(delete_key, self.raise_err,
+                self.conn.putAsync(delete_key, promise.setError,
                                    new_key, entry.value)
 
-        self.conn.getAsync(write_entry, self.raise_err, key)
+        kwargs = {}
+        self._send(promise, kwargs, True, lambda: self.conn.getAsync(
+            write_entry, promise.setError, key, **kwargs))
+        return promise
+
+    @property
+    def supports_batch(self):
+        return hasattr(self.conn, 'begin_batch')
+
+    def _send_no_ack(self, method, on_error, *args, **kwargs):
+        """
+        Queue a request the drive doesn't answer, like the operations of a
+        batch.
+
+        The green client's reader marks an item of the writer queue done
+        for each response, and closing the connection joins that queue, so
+        requests without a response are marked done here once they're
+        queued or a close would wait for them forever.
+
+        :param method: an AsyncClient method, e.g. putAsync
+        :param on_error: called if the request can't be sent
+        """
+        # the same checks the green client makes before queueing, without
+        # yielding in between
+        queued = (self.conn.isConnected and not self.conn.faulted and
+                  not self.conn.closing)
+        method(None, on_error, *args, no_ack=True, **kwargs)
+        if queued:
+            self.conn.queue.task_done()
+
+    def batch(self, puts=(), deletes=(), **kwargs):
+        """
+        Apply puts and deletes atomically in a single Kinetic batch.
+
+        The batch's messages go through the connection's writer queue like
+        any other request, so a batch can share a pooled connection with
+        other requests without their frames interleaving on the wire.
+
+        :param puts: an iterable of (key, value) pairs
+        :param deletes: an iterable of keys
+        :param kwargs: passed on to each operation in the batch, e.g. force
+                       or synchronization
+
+        :returns: a Response that is True once the batch is committed
+        """
+        # self.log_info('batch')
+        puts = list(puts)
+        deletes = list(deletes)
+        promise = Response(self, size=sum(len(value) for key, value in puts),
+                           op_class='write' if puts else 'delete')
+        kwargs.setdefault('priority', self.priority)
+
+        def on_commit(resp):
+            # an aborted batch comes back as a BatchAbortedException
+            if isinstance(resp, Exception):
+                promise.setError(resp)
+            else:
+                promise.setResponse(True)
+
+        def commit():
+            batch_id = self.conn.next_batch_id()
+            self.conn._processAsync(
+                operations.StartBatch(), lambda resp: None, promise.setError,
+                batch_id=batch_id, priority=kwargs['priority'])
+            for key, value in puts:
+                self._send_no_ack(
+                    self.conn.putAsync, promise.setError, key, value,
+                    batch_id=batch_id, **integrity_kwargs(value, kwargs))
+            for key in deletes:
+                self._send_no_ack(
+                    self.conn.deleteAsync, promise.setError, key,
+                    batch_id=batch_id, **kwargs)
+            self.conn._processAsync(
+                operations.EndBatch(), on_commit, promise.setError,
+                batch_id=batch_id, batch_op_count=len(puts) + len(deletes),
+                priority=kwargs['priority'])
+
+        self._send(promise, {'priority': kwargs['priority']}, True, commit)
         return promise
 
-    def copy_keys(self, target, keys, depth=16):
+    def _many(self, method, items, depth, ordered, op_class, **kwargs):
+        """
+        Call method for each item keeping no more than depth of the
+        requests in flight.
+
+        :param method: a method returning a Response, like get or put
+        :param items: an iterable of argument tuples for method, the first
+                      argument is the key
+        :param depth: the max number of requests in flight
+        :param ordered: if True results are yielded in the same order as
+                        items, otherwise as the responses arrive
+        :param op_class: read, write or delete, whose adaptive window
+                         bounds depth
+
+        :returns: an iterator of (key, result, error) tuples, where error
+                  is None or the exception raised getting the result
+        """
+        def start(args):
+            try:
+                return args[0], method(*args, **kwargs)
+            except Exception as e:
+                return args[0], e
+
+        def wait(key, promise):
+            if isinstance(promise, Exception):
+                return key, None, promise
+            try:
+                return key, promise.wait(), None
+            except Exception as e:
+                return key, None, e
+
+        if ordered:
+            pending = deque()
+            for item in items:
+                while len(pending) >= self.window(depth, op_class):
+                    yield wait(*pending.popleft())
+                pending.append(start(item))
+            while pending:
+                yield wait(*pending.popleft())
+            return
+
+        done = Queue()
+        in_flight = 0
+        for item in items:
+            while in_flight >= self.window(depth, op_class):
+                yield done.get()
+                in_flight -= 1
+            key, promise = start(item)
+            if isinstance(promise, Exception):
+                yield wait(key, promise)
+                continue
+            spawn_n(lambda *args: done.put(wait(*args)), key, promise)
+            in_flight += 1
+        while in_flight:
+            yield done.get()
+            in_flight -= 1
+
+    def get_many(self, keys, depth=DEFAULT_MANY_DEPTH, ordered=True,
+                 **kwargs):
+        """
+        Pipelined get of many keys, result is the entry or None if the key
+        was not found.
+        """
+        return self._many(self.get, ((key,) for key in keys), depth,
+                          ordered, 'read', **kwargs)
+
+    def put_many(self, items, depth=DEFAULT_MANY_DEPTH, ordered=True,
+                 **kwargs):
+        """
+        Pipelined put of many (key, value) pairs.
+        """
+        return self._many(self.put, items, depth, ordered, 'write',
+                          **kwargs)
+
+    def delete_many(self, keys, depth=DEFAULT_MANY_DEPTH, ordered=True,
+                    **kwargs):
+        """
+        Pipelined delete of many keys, result is False if the key was not
+        found.
+        """
+        return self._many(self.delete, ((key,) for key in keys), depth,
+                          ordered, 'delete', **kwargs)
+
+    def delete_batched(self, keys, depth=DEFAULT_MANY_DEPTH, **kwargs):
+        """
+        Pipelined delete of many keys, grouped into Kinetic batches of up to
+        batch_max_ops deletes with up to batch_depth batches in flight.
+
+        If the drive doesn't support batches, or batching is disabled, the
+        keys are deleted one at a time with up to depth in flight.  The keys
+        of a batch that fails are retried one at a time too, so that each
+        key gets its own result.
+
+        :returns: an iterator of (key, found, error) tuples like
+                  delete_many, found is True for keys deleted in a batch
+        """
+        if not self.supports_batch or self.batch_max_ops < 2:
+            for result in self.delete_many(keys, depth=depth, **kwargs):
+                yield result
+            return
+
+        def iter_batches():
+            batch = []
+            for key in keys:
+                batch.append(key)
+                if len(batch) >= self.batch_max_ops:
+                    yield (batch,)
+                    batch = []
+            if batch:
+                yield (batch,)
+
+        def delete_batch(batch, **kwargs):
+            return self.batch(deletes=batch, **kwargs)
+
+        for batch, committed, err in self._many(
+                delete_batch, iter_batches(), self.batch_depth, True,
+                'delete', **kwargs):
+            if not err:
+                for key in batch:
+                    yield key, True, None
+                continue
+            for result in self.delete_many(batch, depth=depth, **kwargs):
+                yield result
+
+    def copy_keys(self, target, keys, depth=DEFAULT_MANY_DEPTH):
         # self.log_info('copy_keys')
         host, port = target.split(':')
         target = self.__class__(self.logger, host, int(port))
 
-        def write_entry(entry):
-            target.put(entry.key, entry.value, force=True)
+        def iter_entries():
+            for key, entry, err in self.get_many(keys, depth=depth):
+                if err:
+                    raise err
+                if entry:
+                    yield entry.key, entry.value
 
         with closing(target):
-            for key in keys:
-                self.conn.getAsync(write_entry, self.raise_err, key)
-            self.conn.wait()
-            target.conn.wait()
+            for key, resp, err in target.put_many(
+                    iter_entries(), depth=depth, force=True):
+                if err:
+                    raise err
 
-    def delete_keys(self, keys, depth=16):
+    def delete_keys(self, keys, depth=DEFAULT_MANY_DEPTH):
         # self.log_info('delete_keys')
-        pending = deque()
-        for key in keys:
-            while len(pending) >= depth:
-                found = pending.popleft().wait()
-                if not found:
-                    break
-            pending.append(self.delete(key, force=True))
-
-        for resp in pending:
-            resp.wait()
+        errors = []
+        for key, found, err in self.delete_batched(keys, depth=depth,
+                                                   force=True):
+            if err:
+                errors.append(err)
+        if errors:
+            raise errors[0]
 
     def push_keys(self, target, keys, batch=16):
         # self.log_info('push_keys')
@@ -204,9 +850,11 @@ class KineticSwiftClient(object):
             if len(key_batch) < batch:
                 continue
             # send a batch
-            results.extend(self.conn.push(key_batch, host, port))
+            results.extend(self.conn.push(key_batch, host, port,
+                                          priority=self.priority))
 
             key_batch = []
         if key_batch:
-            results.extend(self.conn.push(key_batch, host, port))
+            results.extend(self.conn.push(key_batch, host, port,
+                                          priority=self.priority))
         return results
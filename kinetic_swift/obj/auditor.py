@@ -25,8 +25,15 @@ from swift.common.storage_policy import POLICIES
 from swift.common.utils import parse_options, list_from_csv
 from swift.obj.auditor import ObjectAuditor, dump_recon_cache, ratelimit_sleep
 from swift import gettext_ as _
-from swift.obj.diskfile import DiskFileNotExist, DiskFileDeviceUnavailable
+from swift.obj.diskfile import (DiskFileNotExist, DiskFileDeviceUnavailable,
+                                get_data_dir)
 from kinetic_swift.obj.server import DiskFileManager
+from kinetic_swift.utils import (iter_sharded_key_range, DEFAULT_SCAN_SHARDS,
+                                 DEFAULT_SCAN_CONCURRENCY)
+
+
+# audits stay out of the way of client requests
+DEFAULT_AUDITOR_PRIORITY = 'lowest'
 
 
 class KineticAuditor(ObjectAuditor):
@@ -34,13 +41,19 @@ class KineticAuditor(ObjectAuditor):
     def __init__(self, *args, **kwargs):
         super(KineticAuditor, self).__init__(*args, **kwargs)
         self.reset_stats()
-        self.mgr = DiskFileManager(self.conf, self.logger)
+        mgr_conf = dict(self.conf)
+        mgr_conf.setdefault('priority', DEFAULT_AUDITOR_PRIORITY)
+        self.mgr = DiskFileManager(mgr_conf, self.logger)
         self.swift_dir = self.conf.get('swift_dir', '/etc/swift')
         self.max_files_per_second = float(
             self.conf.get('files_per_second', 20))
         self.max_bytes_per_second = float(
             self.conf.get('bytes_per_second', 10000000))
         self.interval = 30
+        self.scan_shards = int(self.conf.get('scan_shards',
+                                             DEFAULT_SCAN_SHARDS))
+        self.scan_concurrency = int(self.conf.get('scan_concurrency',
+                                                  DEFAULT_SCAN_CONCURRENCY))
 
     def reset_stats(self):
         self.stats = defaultdict(int)
@@ -76,11 +89,13 @@ class KineticAuditor(ObjectAuditor):
         ])
 
     def _find_objects(self, device):
-        conn = self.mgr.get_connection(*device.split(':'))
-        start_key = 'objects'
-        end_key = 'objects/'
-        for head_key in conn.iterKeyRange(start_key, end_key):
-            yield head_key
+        host, port = device.split(':')
+        for policy in POLICIES:
+            for head_key in iter_sharded_key_range(
+                    lambda: self.mgr.get_connection(host, port),
+                    get_data_dir(policy), shards=self.scan_shards,
+                    concurrency=self.scan_concurrency, ordered=False):
+                yield head_key
 
     def _audit_object(self, device, head_key):
         df = self.mgr.get_diskfile_from_audit_location(
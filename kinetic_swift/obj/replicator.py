@@ -11,31 +11,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import defaultdict, deque
 import errno
+from hashlib import md5
+import json
 from optparse import OptionParser
 import os
 import socket
 import sys
 import time
-import struct
 
 import msgpack
+from eventlet import GreenPool
 
-from swift.common.utils import parse_options, split_path, Timestamp
+from swift.common.utils import (parse_options, split_path, Timestamp,
+                               config_true_value)
 from swift.common.daemon import run_daemon
 from swift.common.direct_client import direct_put_object
-from swift.obj.replicator import ObjectReplicator
+from swift.obj.replicator import ObjectReplicator, dump_recon_cache
 from swift import gettext_ as _
 from swift.common.storage_policy import (
     POLICIES, EC_POLICY, get_policy_string, split_policy_string)
 
-from kinetic_swift.client import KineticSwiftClient
-from kinetic_swift.utils import get_internal_client, key_range_markers
+from kinetic_swift.client import (
+    KineticSwiftClient, CircuitBreaker, CircuitOpen, parse_priority,
+    DEFAULT_PREFETCH, DEFAULT_BATCH_MAX_OPS, DEFAULT_BREAKER_THRESHOLD,
+    DEFAULT_BREAKER_PROBE_INTERVAL, DEFAULT_BREAKER_MAX_PROBE_INTERVAL)
+from kinetic_swift.utils import (
+    get_internal_client, key_range_markers, iter_sharded_key_range,
+    DEFAULT_SCAN_SHARDS, DEFAULT_SCAN_CONCURRENCY)
 from kinetic_swift.obj.server import (object_key, diskfile,
                                       install_kinetic_diskfile, temp_key)
 
 
 CLENAUP_ABORT_UPLOAD_SECONDS = 28800
+# replication is background work, but it shouldn't fall behind audits
+DEFAULT_REPLICATOR_PRIORITY = 'lower'
+DEFAULT_OBJECT_CONCURRENCY = 4
+DEFAULT_PARTITION_DIFF_BATCH = 1000
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+DEFAULT_RING_CHECK_INTERVAL = 15
 
 
 def _cleanup_old_chunks(conn, policy):
@@ -63,6 +78,83 @@ def _cleanup_old_chunks(conn, policy):
         conn.delete(temp_marker, force=True).wait()
 
 
+class PartitionNodeCache(object):
+    """
+    Memoize the nodes of a ring's partitions, and the replication targets
+    of a device's partitions, until the ring reloads.
+
+    :param ring: the object ring
+    :param check_interval: how often (in seconds) to let the ring reload
+                           itself if its file has changed
+    """
+
+    def __init__(self, ring, check_interval=DEFAULT_RING_CHECK_INTERVAL):
+        self.ring = ring
+        self.check_interval = check_interval
+        self.next_check = 0
+        self.version = None
+        self.part_shift = ring._part_shift
+        self.nodes = {}
+        # (device, part, frag_index) => (part, targets, delete)
+        self.targets = {}
+
+    def _check(self):
+        now = time.time()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.check_interval
+        # the ring reloads itself when it's used and its file has changed
+        self.ring.get_part_nodes(0)
+        if self.ring._replica2part2dev_id is not self.version:
+            self.version = self.ring._replica2part2dev_id
+            self.part_shift = self.ring._part_shift
+            self.nodes.clear()
+            self.targets.clear()
+
+    def get_part(self, hashpath):
+        self._check()
+        # ring magic, the partition is the top bits of the hash
+        return int(hashpath[:8], 16) >> self.part_shift
+
+    def get_part_nodes(self, part):
+        try:
+            return self.nodes[part]
+        except KeyError:
+            nodes = self.nodes[part] = self.ring.get_part_nodes(part)
+            return nodes
+
+    def get_targets(self, device, hashpath, frag_index, ec):
+        """
+        :returns: a tuple, (part, targets, delete), where delete is True if
+                  the device isn't a primary for the hashpath
+        """
+        part = self.get_part(hashpath)
+        try:
+            return self.targets[device, part, frag_index]
+        except KeyError:
+            pass
+        nodes = self.get_part_nodes(part)
+        # filter current device from nodes if primary
+        targets = [n for n in nodes if n['device'] != device]
+        if ec:
+            if nodes[frag_index]['device'] == device:
+                # this is the primary device for this frag_index
+                delete = False
+            else:
+                delete = True
+                targets = [n for n in targets if n['index'] == frag_index]
+        else:
+            # the targets for this key do not include our device
+            delete = nodes == targets
+        result = self.targets[device, part, frag_index] = (
+            part, targets, delete)
+        return result
+
+
+def summary_key(policy, part):
+    return '%s.%d' % (get_policy_string('hashes', policy), part)
+
+
 def split_key(key):
     parts = key.split('.')
     base, policy = split_policy_string(parts[0])
@@ -95,17 +187,121 @@ class KineticReplicator(ObjectReplicator):
         self.replication_mode = conf.get('kinetic_replication_mode', 'push')
         self.connect_timeout = int(conf.get('connect_timeout', 3))
         self.response_timeout = int(conf.get('response_timeout', 30))
+        self.key_range_prefetch = int(conf.get('key_range_prefetch',
+                                               DEFAULT_PREFETCH))
+        self.priority = parse_priority(conf.get(
+            'priority', DEFAULT_REPLICATOR_PRIORITY))
+        self.scan_shards = int(conf.get('scan_shards', DEFAULT_SCAN_SHARDS))
+        self.scan_concurrency = int(conf.get('scan_concurrency',
+                                             DEFAULT_SCAN_CONCURRENCY))
+        # handoffs are removed with Kinetic batches of deletes
+        if config_true_value(conf.get('batch_commit', 'true')):
+            self.batch_max_ops = int(conf.get('batch_max_ops',
+                                              DEFAULT_BATCH_MAX_OPS))
+        else:
+            self.batch_max_ops = 0
         # device => [last_used, conn]
         self._conn_pool = {}
+        # device => CircuitBreaker, drives that keep refusing connections
+        # are skipped until a background probe gets through
+        self.breaker_threshold = int(conf.get('breaker_threshold',
+                                              DEFAULT_BREAKER_THRESHOLD))
+        self.breaker_probe_interval = float(conf.get(
+            'breaker_probe_interval', DEFAULT_BREAKER_PROBE_INTERVAL))
+        self.breaker_max_probe_interval = float(conf.get(
+            'breaker_max_probe_interval', DEFAULT_BREAKER_MAX_PROBE_INTERVAL))
+        self._breakers = {}
+        # max_connections caps the drive connections of the whole
+        # replicator, pooled and scan connections alike; with
+        # replicator_workers each worker gets an even share of it (at least
+        # one), so workers don't multiply the connections to a drive
         self.max_connections = int(conf.get('max_connections', 10))
+        # scan connections are short lived and never pooled, but they're
+        # counted with the pool against max_connections
+        self._scan_connections = 0
+        # devices are split between replicator_workers processes, and each
+        # device's objects are replicated object_concurrency at a time
+        self.replicator_workers = max(1, int(conf.get('replicator_workers',
+                                                      1)))
+        self.object_concurrency = max(1, int(conf.get(
+            'object_concurrency', DEFAULT_OBJECT_CONCURRENCY)))
+        # the devices being replicated, their connections are never closed
+        # to stay under max_connections
+        self._replicating = set()
+        self.device_stats = {}
+        # compare each partition's head keys with a range scan of the
+        # targets instead of a getPrevious per object
+        self.partition_diff = config_true_value(conf.get('partition_diff',
+                                                         'false'))
+        self.partition_diff_batch = max(1, int(conf.get(
+            'partition_diff_batch', DEFAULT_PARTITION_DIFF_BATCH)))
+        # each pass stores a digest of the head keys of the device's primary
+        # partitions, partitions with matching digests on every target are
+        # skipped
+        self.partition_summaries = config_true_value(conf.get(
+            'partition_summaries', 'false'))
+        # a pass over a device may be cut short after max_pass_keys objects
+        # or max_pass_seconds, the next pass resumes from the last object
+        # replicated, which is saved every checkpoint_interval objects
+        self.max_pass_keys = int(conf.get('max_pass_keys', 0))
+        self.max_pass_seconds = float(conf.get('max_pass_seconds', 0))
+        self.checkpoint_interval = max(1, int(conf.get(
+            'checkpoint_interval', DEFAULT_CHECKPOINT_INTERVAL)))
+        # int(policy) => PartitionNodeCache
+        self._node_caches = {}
+        self.ring_check_interval = float(conf.get(
+            'ring_check_interval', DEFAULT_RING_CHECK_INTERVAL))
         self.swift = get_internal_client(conf, 'Kinetic Object Rebuilder',
                                          self.logger)
 
-    def iter_all_objects(self, conn, policy):
+    def _iter_scan(self, conn, prefix, end_key=None):
+        """
+        Scan the device's keys under prefix in reverse key order.  Up to
+        scan_concurrency sub-ranges are scanned at once, each on its own
+        connection to the device so they don't queue behind each other (or
+        the replication requests on conn); they're closed after the scan.
+
+        Scan connections count against max_connections, idle pooled
+        connections are closed to make room for them, and once the budget
+        is used up the remaining sub-ranges share the scan connections
+        already open, or conn if there are none.
+        """
+        device = '%s:%s' % (conn.host, conn.port)
+        scan_conns = []
+
+        def get_scan_conn():
+            if len(scan_conns) < self.scan_concurrency:
+                self._close_old_connections(reserve=1)
+                if self._connection_count() < self.max_connections:
+                    # connecting yields, hold the slot meanwhile
+                    self._scan_connections += 1
+                    try:
+                        scan_conn = self.get_breaker(device).call(
+                            self._get_conn, device)
+                    except BaseException:
+                        self._scan_connections -= 1
+                        raise
+                    scan_conns.append(scan_conn)
+                    return scan_conn
+            return min(scan_conns or [conn], key=lambda c: c.outstanding)
+
+        try:
+            for key in iter_sharded_key_range(
+                    get_scan_conn, prefix, shards=self.scan_shards,
+                    concurrency=self.scan_concurrency, reverse=True,
+                    end_key=end_key):
+                yield key
+        finally:
+            for scan_conn in scan_conns:
+                scan_conn.close()
+                self._scan_connections -= 1
+
+    def iter_all_objects(self, conn, policy, end_key=None):
         prefix = get_policy_string('objects', policy)
-        key_range = [prefix + term for term in ('.', '/')]
         last_key, last_key_info = None, {}
-        for key in conn.iterKeyRange(*key_range, reverse=True):
+        # keys must come back in order so that all of the versions of a
+        # hashpath are next to each other, newest first
+        for key in self._iter_scan(conn, prefix, end_key=end_key):
             key_info = split_key(key)
             if key_info['ext'] == 'ts' and Timestamp(
                     key_info['timestamp']) < (
@@ -127,49 +323,193 @@ class KineticReplicator(ObjectReplicator):
                 last_key, last_key_info = key, key_info
         yield last_key
 
+    def get_node_cache(self, policy):
+        cache = self._node_caches.get(int(policy))
+        if cache is None or cache.ring is not policy.object_ring:
+            cache = self._node_caches[int(policy)] = PartitionNodeCache(
+                policy.object_ring, self.ring_check_interval)
+        return cache
+
     def find_target_devices(self, key, policy):
-        key_info = split_key(key)
-        # ring magic, find all of the nodes for the partion of the given hash
-        raw_digest = key_info['hashpath'].decode('hex')
-        part = struct.unpack_from('>I', raw_digest)[0] >> \
-            policy.object_ring._part_shift
-        return policy.object_ring.get_part_nodes(part)
+        cache = self.get_node_cache(policy)
+        return cache.get_part_nodes(cache.get_part(
+            split_key(key)['hashpath']))
+
+    def build_jobs(self, device, keys, policy):
+        """
+        Yield a job for each of the keys, the ring lookups are memoized so
+        a page of keys in the same partitions only looks them up once.
+        """
+        cache = self.get_node_cache(policy)
+        ec = policy.policy_type == EC_POLICY
+        for key in keys:
+            key_info = split_key(key)
+            part, targets, delete = cache.get_targets(
+                device, key_info['hashpath'], key_info['frag_index'], ec)
+            yield {
+                'device': device,
+                'key': key,
+                'key_info': key_info,
+                'part': part,
+                'policy': policy,
+                'frag_index': key_info['frag_index'],
+                # shared by every job for the partition, don't modify it
+                'targets': targets,
+                'delete': delete,
+                # target device => True if the object is on it, filled in
+                # by diff_jobs
+                'synced': {},
+            }
 
     def build_job(self, device, key, policy):
-        key_info = split_key(key)
-        # ring magic, find all of the nodes for the partion of the given hash
-        raw_digest = key_info['hashpath'].decode('hex')
-        part = struct.unpack_from('>I', raw_digest)[0] >> \
-            policy.object_ring._part_shift
-        nodes = policy.object_ring.get_part_nodes(part)
-        # filter current device from nodes if primary
-        targets = [n for n in nodes if n['device'] != device]
-        if policy.policy_type == EC_POLICY:
-            if nodes[key_info['frag_index']]['device'] == device:
-                # this is the primary device for this frag_index
-                delete = False
-            else:
-                delete = True
-                targets = [n for n in targets
-                           if n['index'] == key_info['frag_index']]
-        else:
-            if nodes == targets:
-                # the targets for this key do not include our device
-                delete = True
-            else:
-                # this node is a primary for this part
-                delete = False
-        job = {
-            'device': device,
-            'key': key,
-            'key_info': key_info,
-            'part': part,
-            'policy': policy,
-            'frag_index': key_info['frag_index'],
-            'targets': targets,
-            'delete': delete,
-        }
-        return job
+        return next(self.build_jobs(device, [key], policy))
+
+    def iter_head_keys(self, conn, policy, first_hashpath, last_hashpath):
+        """
+        Yield (hashpath, timestamp) for the newest head key of each hashpath
+        on conn between first_hashpath and last_hashpath, in reverse key
+        order like iter_all_objects.
+        """
+        prefix = get_policy_string('objects', policy)
+        start_key = key_range_markers('%s.%s' % (prefix, first_hashpath))[0]
+        end_key = key_range_markers('%s.%s' % (prefix, last_hashpath))[1]
+        previous = None
+        for key in conn.iterKeyRange(start_key, end_key, reverse=True,
+                                     endKeyInclusive=False):
+            key_info = split_key(key)
+            if not key_info or key_info['hashpath'] == previous:
+                continue
+            previous = key_info['hashpath']
+            yield previous, key_info['timestamp']
+
+    def diff_jobs(self, jobs):
+        """
+        Fill in which targets already have each job's object by merging the
+        jobs with a range scan of the head keys on each target.
+
+        :param jobs: jobs for the same partition, in iter_all_objects order
+        """
+        first_hashpath = jobs[-1]['key_info']['hashpath']
+        last_hashpath = jobs[0]['key_info']['hashpath']
+        for target in jobs[0]['targets']:
+            device = target['device']
+            try:
+                conn = self.get_conn(device)
+                heads = self.iter_head_keys(conn, jobs[0]['policy'],
+                                            first_hashpath, last_hashpath)
+                head = next(heads, None)
+                synced = {}
+                for job in jobs:
+                    key_info = job['key_info']
+                    while head and head[0] > key_info['hashpath']:
+                        head = next(heads, None)
+                    synced[job['key']] = bool(
+                        head and head[0] == key_info['hashpath'] and
+                        head[1] >= key_info['timestamp'])
+            except Exception:
+                # the objects will be checked one at a time
+                self.logger.exception('Unable to diff partition %s with %r',
+                                      jobs[0]['part'], device)
+                continue
+            for job in jobs:
+                job['synced'][device] = synced[job['key']]
+
+    def iter_jobs(self, device, conn, policy, end_key=None):
+        """
+        Yield a job for each object on the device.
+
+        With partition_diff or partition_summaries the jobs are held back a
+        partition (or partition_diff_batch) at a time to be diffed against
+        their targets, or skipped if the partition's summary matches on
+        every target.
+
+        :param end_key: resume a pass, only objects before it are included
+        """
+        all_jobs = self.build_jobs(
+            device, self.iter_all_objects(conn, policy, end_key=end_key),
+            policy)
+        # fragment archives need the frag_index of each target
+        if policy.policy_type == EC_POLICY or not (
+                self.partition_diff or self.partition_summaries):
+            for job in all_jobs:
+                yield job
+            return
+        summarized = set()
+        part = digest = primary = skippable = None
+        jobs = []
+        for job in all_jobs:
+            if job['part'] != part:
+                if part is not None:
+                    for partition_job in self._end_partition(
+                            conn, policy, part, jobs, digest, primary,
+                            skippable):
+                        yield partition_job
+                # a resumed pass only has the tail of its first partition
+                partial = part is None and end_key is not None
+                part, jobs, digest = job['part'], [], md5()
+                primary = not job['delete'] and not partial
+                skippable = self.partition_summaries and primary
+                if primary:
+                    summarized.add(part)
+            digest.update('%(hashpath)s.%(timestamp)s.%(ext)s\n' %
+                          job['key_info'])
+            jobs.append(job)
+            if len(jobs) >= self.partition_diff_batch:
+                # too many to hold back until the digest is known
+                skippable = False
+                for partition_job in self._diff_partition(jobs):
+                    yield partition_job
+                jobs = []
+        if part is not None:
+            for partition_job in self._end_partition(
+                    conn, policy, part, jobs, digest, primary, skippable):
+                yield partition_job
+        if self.partition_summaries and end_key is None:
+            self._remove_old_summaries(conn, policy, summarized)
+
+    def _diff_partition(self, jobs):
+        if self.partition_diff and jobs:
+            self.diff_jobs(jobs)
+        return jobs
+
+    def _end_partition(self, conn, policy, part, jobs, digest, primary,
+                       skippable):
+        if not self.partition_summaries:
+            return self._diff_partition(jobs)
+        digest = digest.hexdigest()
+        if primary:
+            conn.put(summary_key(policy, part), digest, force=True).wait()
+        if skippable and self.is_partition_on_targets(
+                jobs[0]['targets'], policy, part, digest):
+            stats = self.device_stats.setdefault(jobs[0]['device'],
+                                                 defaultdict(int))
+            stats['partitions_skipped'] += 1
+            stats['objects'] += len(jobs)
+            stats['in_sync'] += len(jobs)
+            return []
+        return self._diff_partition(jobs)
+
+    def is_partition_on_targets(self, targets, policy, part, digest):
+        key = summary_key(policy, part)
+        try:
+            resps = [self.get_conn(target['device']).get(key)
+                     for target in targets]
+            entries = [resp.wait() for resp in resps]
+        except Exception as e:
+            self.logger.warning('Unable to get summary of partition %s: %s',
+                                part, e)
+            return False
+        return all(entry and entry.value == digest for entry in entries)
+
+    def _remove_old_summaries(self, conn, policy, summarized):
+        """
+        Remove the summaries of partitions the device no longer has objects
+        for as a primary.
+        """
+        prefix = get_policy_string('hashes', policy)
+        conn.delete_keys([
+            key for key in conn.iterKeyRange(*key_range_markers(prefix))
+            if int(key.rsplit('.', 1)[-1]) not in summarized])
 
     def iter_object_keys(self, conn, key):
         yield key
@@ -206,25 +546,65 @@ class KineticReplicator(ObjectReplicator):
             return False
         return True
 
+    def get_breaker(self, device):
+        try:
+            return self._breakers[device]
+        except KeyError:
+            breaker = self._breakers[device] = CircuitBreaker(
+                device, self.logger, lambda: self._probe(device),
+                threshold=self.breaker_threshold,
+                probe_interval=self.breaker_probe_interval,
+                max_probe_interval=self.breaker_max_probe_interval)
+            return breaker
+
+    def _probe(self, device):
+        conn = self._get_conn(device)
+        pool_entry = self._conn_pool.pop(device, None)
+        if pool_entry:
+            pool_entry[1].close()
+        self._conn_pool[device] = (time.time(), conn)
+
     def get_conn(self, device):
+        """
+        :raises CircuitOpen: if the device's circuit breaker is open
+        """
         now = time.time()
+        breaker = self.get_breaker(device)
         try:
             pool_entry = self._conn_pool[device]
         except KeyError:
             self.logger.debug('Creating new connection to %r', device)
             self._close_old_connections()
-            conn = self._get_conn(device)
+            conn = breaker.call(self._get_conn, device)
+            # connecting yields, another job may have pooled a connection
+            # to the device meanwhile; keep that one
+            pool_entry = self._conn_pool.get(device)
+            if pool_entry:
+                conn.close()
+                conn = pool_entry[1]
         else:
             conn = pool_entry[1]
         if conn.faulted or not conn.isConnected:
-            conn.reconnect()
+            breaker.call(conn.reconnect)
         self._conn_pool[device] = (now, conn)
         return conn
 
-    def _close_old_connections(self):
-        oldest_keys = sorted(self._conn_pool, key=lambda k:
-                             self._conn_pool[k][0])
-        while len(self._conn_pool) > self.max_connections:
+    def _connection_count(self):
+        return len(self._conn_pool) + self._scan_connections
+
+    def _close_old_connections(self, reserve=0):
+        """
+        Close the least recently used pooled connections until there's room
+        for reserve new ones under max_connections.
+        """
+        # connections with requests in flight might be shared with another
+        # greenthread, they're left open until they're idle
+        oldest_keys = sorted(
+            (k for k in self._conn_pool if k not in self._replicating and
+             not self._conn_pool[k][1].outstanding),
+            key=lambda k: self._conn_pool[k][0])
+        while (self._connection_count() + reserve > self.max_connections and
+               oldest_keys):
             device = oldest_keys.pop(0)
             pool_entry = self._conn_pool.pop(device)
             last_used, conn = pool_entry
@@ -238,6 +618,9 @@ class KineticReplicator(ObjectReplicator):
             self.logger, host, int(port),
             connect_timeout=self.connect_timeout,
             response_timeout=self.response_timeout,
+            prefetch=self.key_range_prefetch,
+            batch_max_ops=self.batch_max_ops,
+            priority=self.priority,
         )
         return conn
 
@@ -294,12 +677,20 @@ class KineticReplicator(ObjectReplicator):
                           headers=headers)
 
     def replicate_object(self, conn, job):
+        stats = self.device_stats.setdefault(job['device'],
+                                             defaultdict(int))
+        stats['objects'] += 1
         keys = None
         success = 0
+        in_sync = 0
         for target in job['targets']:
             try:
-                if self.is_object_on_target(target, job['key']):
+                synced = job.get('synced', {}).get(target['device'])
+                if synced is None:
+                    synced = self.is_object_on_target(target, job['key'])
+                if synced:
                     success += 1
+                    in_sync += 1
                     continue
                 if (job['policy'].policy_type == EC_POLICY
                         and not job['delete']):
@@ -312,25 +703,119 @@ class KineticReplicator(ObjectReplicator):
             except Exception:
                 self.logger.exception('Unable to replicate %r to %r',
                                       job['key'], target['device'])
+                stats['failures'] += 1
             else:
                 self.logger.info('Successfully replicated %r to %r',
                                  job['key'], target['device'])
                 success += 1
+                stats['replicated'] += 1
+        if in_sync >= len(job['targets']):
+            stats['in_sync'] += 1
         if job['delete'] and success >= len(job['targets']):
             # might be nice to drop the whole partition at once
             keys = keys or list(self.iter_object_keys(conn, job['key']))
             conn.delete_keys(keys)
             self.logger.info(
                 'successfully removed handoff %(key)r to %(device)r', job)
+            stats['handoffs_removed'] += 1
 
-    def replicate_device(self, device, conn, policy):
-        self.logger.info('begining replication pass for %r', device)
-        for key in self.iter_all_objects(conn, policy):
-            job = self.build_job(device, key, policy)
-            # refresh conn
-            conn = self.get_conn(device)
+    def _replicate_job(self, conn, job):
+        try:
             self.replicate_object(conn, job)
-        _cleanup_old_chunks(conn, policy)
+        except Exception:
+            self.logger.exception('Unhandled exception replicating %r',
+                                  job['key'])
+            self.device_stats[job['device']]['failures'] += 1
+
+    def _checkpoint_file(self, device):
+        return os.path.join(self.recon_cache_path,
+                            'kinetic_replicator.%s.recon' % device)
+
+    def load_checkpoint(self, device, policy):
+        """
+        :returns: the last head key replicated by an unfinished pass over
+                  the device, or None
+        """
+        try:
+            with open(self._checkpoint_file(device)) as f:
+                return json.load(f).get(str(int(policy)))
+        except (IOError, ValueError):
+            return None
+
+    def save_checkpoint(self, device, policy, key):
+        dump_recon_cache({str(int(policy)): key},
+                         self._checkpoint_file(device), self.logger)
+
+    def _pass_limit_reached(self, count, start):
+        if self.max_pass_keys and count >= self.max_pass_keys:
+            return True
+        if self.max_pass_seconds and \
+                time.time() - start >= self.max_pass_seconds:
+            return True
+        return False
+
+    def replicate_device(self, device, conn, policy):
+        start = time.time()
+        stats = self.device_stats[device] = defaultdict(int)
+        checkpoint = self.load_checkpoint(device, policy)
+        if checkpoint:
+            self.logger.info('resuming replication pass for %r after %r',
+                             device, checkpoint)
+            end_key = key_range_markers('%s.%s' % (
+                get_policy_string('objects', policy),
+                split_key(checkpoint)['hashpath']))[0]
+        else:
+            self.logger.info('begining replication pass for %r', device)
+            end_key = None
+        self._replicating.add(device)
+        try:
+            # the async client pipelines requests, so concurrent objects
+            # share the device's connection
+            pool = GreenPool(self.object_concurrency)
+            # keys in scan order until they're replicated, objects finish
+            # out of order but the checkpoint only moves past a key once
+            # every key before it is done
+            pending = deque()
+            done = set()
+
+            def replicate_job(conn, job):
+                try:
+                    self._replicate_job(conn, job)
+                finally:
+                    done.add(job['key'])
+
+            finished = True
+            jobs = self.iter_jobs(device, conn, policy, end_key=end_key)
+            for count, job in enumerate(jobs, 1):
+                # refresh conn
+                conn = self.get_conn(device)
+                pending.append(job['key'])
+                pool.spawn_n(replicate_job, conn, job)
+                while pending and pending[0] in done:
+                    checkpoint = pending.popleft()
+                    done.discard(checkpoint)
+                if count % self.checkpoint_interval == 0:
+                    self.save_checkpoint(device, policy, checkpoint)
+                if self._pass_limit_reached(count, start):
+                    finished = False
+                    jobs.close()
+                    break
+            pool.waitall()
+            if finished:
+                _cleanup_old_chunks(conn, policy)
+                checkpoint = None
+            elif pending:
+                checkpoint = pending[-1]
+            self.save_checkpoint(device, policy, checkpoint)
+            if not finished:
+                self.logger.info('replication pass for %r stopped after '
+                                 '%r', device, checkpoint)
+        finally:
+            self._replicating.discard(device)
+            stats['elapsed'] = time.time() - start
+            self.logger.info('replication pass for %r complete: %s', device,
+                             ', '.join('%s=%s' % item
+                                       for item in sorted(stats.items())))
 
     def _replicate(self, *devices, **kwargs):
         policy = kwargs.get('policy', POLICIES.legacy)
@@ -339,6 +824,9 @@ class KineticReplicator(ObjectReplicator):
                 # might be a good place to go multiprocess
                 try:
                     conn = self.get_conn(device)
+                except CircuitOpen as e:
+                    self.logger.warning('Skipping device %r: %s', device, e)
+                    continue
                 except:
                     self.logger.exception(
                         'Unable to connect to device: %r', device)
@@ -353,18 +841,13 @@ class KineticReplicator(ObjectReplicator):
                 self.logger.exception('Unhandled exception with '
                                       'replication for device %r', device)
 
-    def replicate(self, override_devices=None, **kwargs):
-        self.start = time.time()
-        self.suffix_count = 0
-        self.suffix_sync = 0
-        self.suffix_hash = 0
-        self.replication_count = 0
-        self.last_replication_count = -1
-        self.partition_times = []
+    def _replicate_policies(self, override_devices=None, worker=0,
+                            workers=1):
         for policy in POLICIES:
             obj_ring = self.load_object_ring(policy)
             devices = override_devices or [d['device'] for d in
                                            obj_ring.devs if d]
+            devices = devices[worker::workers]
             self.logger.debug(_("Begin replication for %r"), policy)
             try:
                 self._replicate(*devices, policy=policy)
@@ -373,6 +856,62 @@ class KineticReplicator(ObjectReplicator):
                     _("Exception in top-level replication loop"))
             self.logger.info('replication cycle for %r complete', devices)
 
+    def _replicate_in_workers(self, override_devices=None):
+        # each worker sends its device_stats back on a pipe as it exits
+        workers = []
+        for worker in range(self.replicator_workers):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid:
+                os.close(write_fd)
+                workers.append((pid, read_fd))
+                continue
+            os.close(read_fd)
+            status = 0
+            try:
+                # the parent's connections stay with the parent, workers
+                # split the connection budget between them
+                self._conn_pool = {}
+                self._scan_connections = 0
+                self._breakers = {}
+                self.max_connections = max(
+                    1, self.max_connections // self.replicator_workers)
+                self._replicate_policies(override_devices, worker,
+                                         self.replicator_workers)
+                with os.fdopen(write_fd, 'w') as stats_pipe:
+                    json.dump(self.device_stats, stats_pipe)
+            except Exception:
+                self.logger.exception('Unhandled exception in replication '
+                                      'worker %s', worker)
+                status = 1
+            finally:
+                os._exit(status)
+        for pid, read_fd in workers:
+            with os.fdopen(read_fd) as stats_pipe:
+                worker_stats = stats_pipe.read()
+            os.waitpid(pid, 0)
+            if not worker_stats:
+                # the worker died before it was done
+                continue
+            # workers replicate disjoint sets of devices
+            for device, stats in json.loads(worker_stats).items():
+                self.device_stats[str(device)] = defaultdict(int, (
+                    (str(stat), value) for stat, value in stats.items()))
+
+    def replicate(self, override_devices=None, **kwargs):
+        self.start = time.time()
+        self.suffix_count = 0
+        self.suffix_sync = 0
+        self.suffix_hash = 0
+        self.replication_count = 0
+        self.last_replication_count = -1
+        self.partition_times = []
+        self.device_stats = {}
+        if self.replicator_workers > 1:
+            self._replicate_in_workers(override_devices)
+        else:
+            self._replicate_policies(override_devices)
+
 
 def main():
     try:
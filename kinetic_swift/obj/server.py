@@ -14,23 +14,50 @@
 import os
 import logging
 from contextlib import contextmanager
-from collections import deque
+from collections import deque, defaultdict, OrderedDict
 from uuid import uuid4
-from eventlet import sleep, Timeout, spawn_n
+from eventlet import sleep, Timeout, spawn_n, GreenPool, event
 import re
 import time
 
 import msgpack
 from swift.obj import diskfile, server
+from swift.common.swob import HTTPServiceUnavailable
+from swift.common.utils import multi_range_iterator
 from swift.common.storage_policy import (POLICIES, split_policy_string,
                                          PolicyError)
 
-from kinetic_swift.client import KineticSwiftClient
+from kinetic_swift.client import (
+    KineticSwiftClient, SingleFlight, CircuitBreaker, CircuitOpen,
+    parse_priority, DEFAULT_PREFETCH, DEFAULT_BATCH_MAX_OPS,
+    DEFAULT_BREAKER_PROBE_INTERVAL, DEFAULT_BREAKER_MAX_PROBE_INTERVAL,
+    DEFAULT_MAX_IN_FLIGHT)
+from kinetic_swift.utils import gauge
 
 from kinetic.common import Synchronization
 
 
 DEFAULT_DEPTH = 2
+# kinetic's green client holds back requests beyond 10 pending on a
+# connection, a deeper window would only queue in the client
+DEFAULT_MAX_DEPTH = 8
+DEFAULT_TARGET_LATENCY = 0.25
+DEFAULT_CONNECTIONS_PER_DEVICE = 4
+DEFAULT_BATCH_MAX_BYTES = 2 ** 20
+DEFAULT_HEAD_CACHE_MAX_BYTES = 16 * 2 ** 20
+DEFAULT_HEAD_CACHE_TTL = 5.0
+DEFAULT_CHUNK_CACHE_DOORKEEPER_SIZE = 4096
+DEFAULT_CLEANUP_CONCURRENCY = 2
+DEFAULT_CLEANUP_DELAY = 1.0
+DEFAULT_CLEANUP_MAX_PENDING = 10000
+DEFAULT_GROUP_COMMIT_WINDOW = 0.0
+DEFAULT_ADMISSION_QUEUE_SIZE = 0
+DEFAULT_ADMISSION_QUEUE_TIMEOUT = 0.1
+DEFAULT_PRIORITY = 'normal'
+DEFAULT_CLEANUP_PRIORITY = 'lower'
+
+# the first bytes of an object may be stored in its head key's value
+INLINE_DATA_KEY = 'X-Kinetic-Inline-Data'
 
 
 SYNC_OPTION_MAP = {
@@ -94,6 +121,548 @@ def get_nonce(key):
     return '-'.join(nonce_parts[:5])
 
 
+class DepthController(object):
+    """
+    Additive-increase/multiplicative-decrease window of in-flight requests
+    of one op class (reads, writes or deletes) for a single drive.
+
+    Every response that comes back under the target latency grows the
+    window by roughly one request per window's worth of responses, a slow
+    response or a timeout cuts it in half (at most once per target latency
+    so one burst of slow responses only backs off once).
+
+    :param name: the drive and op class (host:port.op_class), used in
+                 metric names
+    :param logger: a swift LogAdapter
+    :param target_latency: seconds a response may take before backing off
+    :param min_depth: the smallest window
+    :param max_depth: the largest window
+    :param initial_depth: the starting window
+    """
+
+    def __init__(self, name, logger, target_latency=DEFAULT_TARGET_LATENCY,
+                 min_depth=1, max_depth=DEFAULT_MAX_DEPTH,
+                 initial_depth=DEFAULT_DEPTH):
+        self.name = name
+        self.logger = logger
+        self.target_latency = target_latency
+        self.min_depth = min_depth
+        self.max_depth = max(min_depth, max_depth)
+        self.window = float(max(min_depth, min(initial_depth,
+                                               self.max_depth)))
+        self.last_decrease = 0
+
+    @property
+    def depth(self):
+        return int(self.window)
+
+    def bound(self, upper):
+        """
+        The current window, limited to the given upper bound.
+        """
+        return max(self.min_depth, min(upper, self.depth))
+
+    def _set_window(self, window):
+        depth = self.depth
+        self.window = window
+        if self.depth != depth:
+            gauge(self.logger, 'depth.%s' % self.name, self.depth)
+
+    def observe(self, latency):
+        if latency > self.target_latency:
+            self.decrease()
+        else:
+            self._set_window(min(self.max_depth,
+                                 self.window + 1.0 / self.window))
+
+    def decrease(self):
+        now = time.time()
+        if now - self.last_decrease < self.target_latency:
+            return
+        self.last_decrease = now
+        self._set_window(max(self.min_depth, self.window / 2))
+
+
+class HeadCache(object):
+    """
+    Per-worker LRU of decoded head keys, so opening a hot object doesn't
+    cost a getPrevious round trip and an unpack every time.
+
+    Entries are only invalidated by DiskFiles in this worker, changes made
+    by anyone else are picked up once an entry is older than the ttl.  A
+    read that was in flight while any entry was invalidated isn't cached,
+    so a racing PUT can't be papered over by the head key it replaced.
+
+    :param logger: a swift LogAdapter
+    :param max_entries: the most head keys to keep
+    :param max_bytes: the most head key bytes to keep, 0 keeps nothing
+    :param ttl: seconds an entry is trusted, 0 keeps nothing
+    """
+
+    def __init__(self, logger, max_entries, max_bytes=None, ttl=None):
+        self.logger = logger
+        self.max_entries = max_entries
+        if max_bytes is None:
+            max_bytes = DEFAULT_HEAD_CACHE_MAX_BYTES
+        self.max_bytes = max_bytes
+        if ttl is None:
+            ttl = DEFAULT_HEAD_CACHE_TTL
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _pop(self, key):
+        try:
+            value, size, expires = self._entries.pop(key)
+        except KeyError:
+            return None
+        self.size -= size
+        return value, size, expires
+
+    def _miss(self):
+        self.misses += 1
+        self.logger.increment('head_cache.miss')
+
+    def get(self, key):
+        """
+        :returns: the cached value, or None if it's missing or expired
+        """
+        found = self._pop(key)
+        if not found:
+            return self._miss()
+        value, size, expires = found
+        if expires < time.time():
+            return self._miss()
+        # re-insert as the most recently used
+        self._entries[key] = found
+        self.size += size
+        self.hits += 1
+        self.logger.increment('head_cache.hit')
+        return value
+
+    def set(self, key, value, size, generation):
+        """
+        Cache a value read while the cache was at the given generation.
+        """
+        if generation != self.generation or size > self.max_bytes or \
+                self.max_bytes <= 0 or self.ttl <= 0:
+            return
+        self._pop(key)
+        self._entries[key] = (value, size, time.time() + self.ttl)
+        self.size += size
+        while len(self._entries) > self.max_entries or \
+                self.size > self.max_bytes:
+            _key, (_value, evicted, _expires) = self._entries.popitem(
+                last=False)
+            self.size -= evicted
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._pop(key)
+
+
+class ChunkCache(object):
+    """
+    Per-worker LRU of chunk values, bounded by bytes.
+
+    A chunk key includes the nonce of the upload that wrote it and is never
+    written again, so a cached chunk can't go stale and nothing needs to be
+    invalidated.
+
+    A chunk is only admitted the second time it's missed, the keys that
+    have been missed once are remembered in a small doorkeeper LRU.  That
+    way a single large streaming read passes through without flushing the
+    chunks of popular objects.
+
+    :param logger: a swift LogAdapter
+    :param max_bytes: the most chunk bytes to keep
+    :param doorkeeper_size: how many once-missed keys to remember
+    """
+
+    def __init__(self, logger, max_bytes,
+                 doorkeeper_size=DEFAULT_CHUNK_CACHE_DOORKEEPER_SIZE):
+        self.logger = logger
+        self.max_bytes = max_bytes
+        self.doorkeeper_size = doorkeeper_size
+        self._entries = OrderedDict()
+        self._doorkeeper = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.bytes_saved = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """
+        :returns: the cached value, or None
+        """
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            self.logger.increment('chunk_cache.miss')
+            return None
+        # re-insert as the most recently used
+        self._entries[key] = value
+        self.hits += 1
+        self.bytes_saved += len(value)
+        self.logger.increment('chunk_cache.hit')
+        self.logger.update_stats('chunk_cache.bytes_saved', len(value))
+        return value
+
+    def add(self, key, value):
+        """
+        Offer a value read from the drive to the cache.
+        """
+        if key in self._entries or len(value) > self.max_bytes:
+            return
+        if self._doorkeeper.pop(key, None) is None:
+            self._doorkeeper[key] = True
+            if len(self._doorkeeper) > self.doorkeeper_size:
+                self._doorkeeper.popitem(last=False)
+            return
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _key, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class CleanupQueue(object):
+    """
+    Per-worker queue of hashpaths whose old versions need to be removed
+    after a PUT or DELETE.
+
+    A hashpath that's written again while it's queued is merged into the
+    pass that's already queued, and every pass waits in the queue for at
+    least delay seconds, so a burst of overwrites of a hot object costs
+    the drive a single pass.  At most concurrency passes run at once.
+
+    Only the keys to clean up are queued, not the DiskFile that was written
+    (or its buffers and connection), the cleanup callable picks a
+    connection when the pass runs.
+
+    :param logger: a swift LogAdapter
+    :param cleanup: called with (key, timestamp, temp_markers, scan) to run
+                    a pass, see DiskFileManager.cleanup_old_versions
+    :param concurrency: the most cleanup passes to run at once
+    :param delay: the least seconds a hashpath waits in the queue
+    :param max_pending: the most hashpaths to queue, when the queue is full
+                        writers have to clean up after themselves
+    """
+
+    def __init__(self, logger, cleanup,
+                 concurrency=DEFAULT_CLEANUP_CONCURRENCY,
+                 delay=DEFAULT_CLEANUP_DELAY,
+                 max_pending=DEFAULT_CLEANUP_MAX_PENDING):
+        self.logger = logger
+        self.cleanup = cleanup
+        self.delay = delay
+        self.max_pending = max_pending
+        self.pool = GreenPool(concurrency)
+        self.pending = OrderedDict()
+        self.merged = 0
+        self._running = False
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _update_depth(self):
+        gauge(self.logger, 'cleanup_queue.depth', len(self.pending))
+
+    def add(self, key, timestamp, temp_markers=(), scan=True):
+        """
+        Queue a cleanup pass, see DiskFile._unlink_old.
+
+        :param key: the (device, policy index, hashpath) to clean up
+        :param timestamp: remove the versions older than this Timestamp
+        :param temp_markers: temp marker keys to remove
+        :param scan: False if there's no older version to look for
+
+        :returns: False if the queue is full
+        """
+        entry = self.pending.get(key)
+        if entry:
+            if timestamp > entry['timestamp']:
+                entry['timestamp'] = timestamp
+            entry['temp_markers'].extend(temp_markers)
+            entry['scan'] = entry['scan'] or scan
+            self.merged += 1
+            self.logger.increment('cleanup_queue.merged')
+            return True
+        if len(self.pending) >= self.max_pending:
+            return False
+        self.pending[key] = {
+            'timestamp': timestamp,
+            'temp_markers': list(temp_markers),
+            'scan': scan,
+            'queued': time.time(),
+        }
+        self._update_depth()
+        if not self._running:
+            self._running = True
+            spawn_n(self._run)
+        return True
+
+    def _run(self):
+        try:
+            while self.pending:
+                key = next(iter(self.pending))
+                wait = self.pending[key]['queued'] + self.delay - time.time()
+                if wait > 0:
+                    sleep(wait)
+                    continue
+                entry = self.pending.pop(key)
+                self._update_depth()
+                # blocks while concurrency passes are already running
+                self.pool.spawn_n(self._clean, key, entry)
+        finally:
+            self._running = False
+
+    def _clean(self, key, entry):
+        try:
+            self.cleanup(key, entry['timestamp'],
+                         temp_markers=entry['temp_markers'],
+                         scan=entry['scan'])
+        except Exception:
+            self.logger.exception('Unable to clean up old versions of %s' %
+                                  key[2])
+
+
+class GroupCommit(object):
+    """
+    Share FLUSH commands between the writes to a single drive.
+
+    Writers send their keys with WRITEBACK and then wait here for a flush
+    sent after their writes were acknowledged.  The first writer opens a
+    group and the flushes go out window seconds later (or once the flushes
+    already in flight come back).  A flush is sent on each connection that
+    writers in the group used, and each writer is released when the flush
+    on its connection completes.
+
+    :param name: the drive (host:port), used in log messages
+    :param logger: a swift LogAdapter
+    :param window: seconds to hold a group open for more writers
+    """
+
+    def __init__(self, name, logger, window=DEFAULT_GROUP_COMMIT_WINDOW):
+        self.name = name
+        self.logger = logger
+        self.window = window
+        # KineticSwiftClient => Event for the writers that used it
+        self.group = None
+        self.group_size = 0
+        self.flushes = 0
+        self._running = False
+
+    def wait(self, conn):
+        """
+        Block until a flush covers the writes already acknowledged by the
+        drive.
+
+        :param conn: the KineticSwiftClient the writes were sent on, the
+                     flush is sent on it too
+        """
+        if self.group is None:
+            self.group = {}
+            self.group_size = 0
+        self.group_size += 1
+        try:
+            waiters = self.group[conn]
+        except KeyError:
+            waiters = self.group[conn] = event.Event()
+        if not self._running:
+            self._running = True
+            spawn_n(self._run)
+        waiters.wait()
+
+    def _flush(self, group):
+        flushes = []
+        for conn, waiters in group.items():
+            try:
+                flushes.append((conn.flush(), waiters))
+            except Exception as e:
+                flushes.append((e, waiters))
+        for resp, waiters in flushes:
+            try:
+                if isinstance(resp, Exception):
+                    raise resp
+                resp.wait()
+            except Exception as e:
+                self.logger.error('Unable to flush drive %s: %s' % (
+                    self.name, e))
+                waiters.send_exception(e)
+            else:
+                waiters.send(None)
+            self.flushes += 1
+            self.logger.increment('group_commit.flushes')
+
+    def _run(self):
+        try:
+            while self.group is not None:
+                sleep(self.window)
+                group, self.group = self.group, None
+                self.logger.update_stats('group_commit.writes',
+                                         self.group_size)
+                self._flush(group)
+        finally:
+            self._running = False
+
+
+class DriveBusy(Exception):
+    pass
+
+
+class AdmissionControl(object):
+    """
+    Limit the work a worker piles onto a single drive.
+
+    Every request to the drive is counted while it's in flight, along with
+    the bytes it's writing.  While either is over its limit new client
+    requests wait in a short queue for the drive to catch up, one is let
+    in as each request in flight comes back.  A request that finds the
+    queue full, or is still waiting after queue_timeout seconds, is shed
+    with DriveBusy so the proxy can try another node.
+
+    :param name: the drive (host:port), used in log messages
+    :param logger: a swift LogAdapter
+    :param max_ops: the most requests in flight, 0 for no limit
+    :param max_bytes: the most bytes being written, 0 for no limit
+    :param queue_size: the most requests waiting, 0 to shed right away
+    :param queue_timeout: the most seconds a request waits
+    """
+
+    def __init__(self, name, logger, max_ops=0, max_bytes=0,
+                 queue_size=DEFAULT_ADMISSION_QUEUE_SIZE,
+                 queue_timeout=DEFAULT_ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.logger = logger
+        self.max_ops = max_ops
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.ops = self.bytes = 0
+        self.waiting = deque()
+        self.shed = 0
+
+    @property
+    def overloaded(self):
+        return (self.max_ops and self.ops >= self.max_ops) or \
+            (self.max_bytes and self.bytes >= self.max_bytes)
+
+    def start(self, size):
+        self.ops += 1
+        self.bytes += size
+
+    def finish(self, size):
+        self.ops -= 1
+        self.bytes -= size
+        if self.waiting and not self.overloaded:
+            self.waiting.popleft().send(None)
+
+    def admit(self):
+        """
+        Wait for room on the drive.
+
+        :raises DriveBusy: if the request is shed
+        """
+        if not (self.overloaded or self.waiting):
+            return
+        if len(self.waiting) < self.queue_size:
+            self.logger.increment('admission.queued')
+            admitted = event.Event()
+            self.waiting.append(admitted)
+            with Timeout(self.queue_timeout, False):
+                admitted.wait()
+            if admitted.ready():
+                return
+            self.waiting.remove(admitted)
+        self.shed += 1
+        self.logger.increment('admission.shed')
+        raise DriveBusy('Drive %s is busy (%d requests, %d bytes)' % (
+            self.name, self.ops, self.bytes))
+
+
+class ChunkBuffer(object):
+    """
+    Collects the strings written to a DiskFile and hands them back in
+    chunks.  A chunk that comes from a single write is a memoryview of it
+    and isn't copied, a chunk that spans writes is joined together once
+    (only the partial writes at either end get sliced first).
+    """
+
+    def __init__(self):
+        self._pieces = deque()
+        # how much of the first piece has already been taken
+        self._offset = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, data):
+        if data:
+            self._pieces.append(data)
+            self._size += len(data)
+
+    def _advance(self, size):
+        self._offset += size
+        self._size -= size
+        if self._offset >= len(self._pieces[0]):
+            self._pieces.popleft()
+            self._offset = 0
+
+    def take(self, size):
+        """
+        Remove up to size bytes from the front of the buffer.
+
+        :returns: a str or memoryview
+        """
+        size = min(size, self._size)
+        if not size:
+            return ''
+        piece = self._pieces[0]
+        if len(piece) - self._offset >= size:
+            if not self._offset and len(piece) == size:
+                chunk = piece
+            else:
+                chunk = memoryview(piece)[self._offset:self._offset + size]
+            self._advance(size)
+            return chunk
+        parts = []
+        needed = size
+        while needed:
+            piece = self._pieces[0]
+            length = min(len(piece) - self._offset, needed)
+            if self._offset or length < len(piece):
+                piece = piece[self._offset:self._offset + length]
+            parts.append(piece)
+            needed -= length
+            self._advance(length)
+        return ''.join(parts)
+
+
+def to_str(chunk, start=0, stop=None):
+    """
+    Copy the bytes of chunk[start:stop] out of a value buffer.
+
+    Anything handed to swob or the WSGI server has to be a str, so this
+    is the one copy a chunk goes through on the way out, range slicing is
+    done on a memoryview so only the bytes that are needed get copied.
+    """
+    if isinstance(chunk, str):
+        return chunk[start:stop]
+    return memoryview(chunk)[start:stop].tobytes()
+
+
 class DiskFileReader(diskfile.DiskFileReader):
 
     def __init__(self, diskfile):
@@ -101,31 +670,69 @@ class DiskFileReader(diskfile.DiskFileReader):
         self.diskfile = diskfile
         self._suppress_file_closing = False
 
+    def _iter_ranges(self, ranges):
+        """
+        Fetch exactly the chunks needed for a list of byte ranges, chunks
+        shared by more than one range are only fetched once.
+
+        :param ranges: a list of (start, stop) byte ranges
+        :returns: a list with an iterator of the bytes for each range, they
+                  must be consumed in order
+        """
+        plans = [self.diskfile.plan_range(start, stop)
+                 for start, stop in ranges]
+        uses = defaultdict(int)
+        fetch_order = []
+        for plan in plans:
+            for chunk_id, start, stop in plan:
+                if chunk_id not in uses:
+                    fetch_order.append(chunk_id)
+                uses[chunk_id] += 1
+        fetched = self.diskfile.iter_chunks(fetch_order)
+        cache = {}
+
+        def get_chunk(chunk_id):
+            try:
+                chunk = cache[chunk_id]
+            except KeyError:
+                chunk = next(fetched)
+            uses[chunk_id] -= 1
+            if uses[chunk_id]:
+                cache[chunk_id] = chunk
+            else:
+                cache.pop(chunk_id, None)
+            return chunk
+
+        def iter_plan(plan):
+            for chunk_id, start, stop in plan:
+                yield to_str(get_chunk(chunk_id), start, stop)
+
+        return [iter_plan(plan) for plan in plans]
+
     def app_iter_range(self, start, stop):
-        r = 0
-        if start or start == 0:
-            q, r = divmod(start, self.diskfile.disk_chunk_size)
-            self.diskfile.chunk_id = q
-        if stop is not None:
-            length = stop - start
-        else:
-            length = None
         try:
-            for chunk in self:
-                if length is not None:
-                    length -= len(chunk) - r
-                    if length < 0:
-                        # Chop off the extra:
-                        yield chunk[r:length]
-                        break
-                yield chunk[r:]
-                r = 0
+            for chunk in self._iter_ranges([(start, stop)])[0]:
+                yield chunk
         finally:
             if not self._suppress_file_closing:
                 self.close()
 
+    def app_iter_ranges(self, ranges, content_type, boundary, size):
+        if not ranges:
+            yield ''
+            return
+        range_iters = iter(self._iter_ranges(ranges))
+        try:
+            for chunk in multi_range_iterator(
+                    ranges, content_type, boundary, size,
+                    lambda start, stop: next(range_iters)):
+                yield chunk
+        finally:
+            self.close()
+
     def __iter__(self):
-        return iter(self.diskfile)
+        for chunk in self.diskfile:
+            yield to_str(chunk)
 
     def close(self):
         return self.diskfile.close()
@@ -146,35 +753,82 @@ class DiskFile(diskfile.DiskFile):
         self._took_reader = False
         super(DiskFile, self).__init__(mgr, device_path, *args, **kwargs)
         self.hashpath = os.path.basename(self._datadir.rstrip('/'))
-        self._buffer = bytearray()
+        self._device = '%s:%s' % (host, port)
+        self._buffer = ChunkBuffer()
         self._nonce = None
-        self.chunk_id = 0
+        self._inline_data = None
+        # the newest head key, None if there isn't one, only known once the
+        # diskfile has been read or written
+        self._head_known = False
+        self._head_key = None
         self.upload_size = 0
-        self.last_sync = 0
         # configurables
         self.write_depth = self._manager.write_depth
         self.read_depth = self._manager.read_depth
         self.delete_depth = self._manager.delete_depth
         self.synchronization = self._manager.synchronization
+        self.cleanup_priority = self._manager.cleanup_priority
+        self.inline_max_bytes = self._manager.inline_max_bytes
+        self.head_cache = self._manager.head_cache
+        self.chunk_cache = self._manager.chunk_cache
         self.conn = None
         self.conn = mgr.get_connection(host, port)
+        if self._manager.batch_commit and self.conn.supports_batch:
+            self.batch_max_ops = self._manager.batch_max_ops
+            self.batch_max_bytes = self._manager.batch_max_bytes
+        else:
+            self.batch_max_ops = self.batch_max_bytes = 0
+        self.depth_controllers = self.conn.depth_controllers
+        # with group commit FLUSH writes go out WRITEBACK and share a flush
+        self.group_commit = self.conn.group_commit
         self.logger = mgr.logger
 
+    def _depth(self, upper, op_class):
+        return self.conn.window(upper, op_class)
+
     def object_key(self, timestamp='', **kwargs):
         return object_key(policy=self.policy, hashpath=self.hashpath,
                           timestamp=timestamp, extension=self._extension,
                           nonce=self._nonce, **kwargs)
 
+    @property
+    def _head_cache_key(self):
+        return (self._device, int(self.policy), self.hashpath)
+
+    def _invalidate_head(self):
+        if self.head_cache is not None:
+            self.head_cache.invalidate(self._head_cache_key)
+        if self.conn.single_flight is not None:
+            # later opens shouldn't join a read of the replaced head key
+            self.conn.single_flight.forget(('getPrevious', self.object_key()))
+
     def _read(self):
+        if self.head_cache is not None:
+            head = self.head_cache.get(self._head_cache_key)
+            if head:
+                return self._load_head(*head)
+            generation = self.head_cache.generation
         key = self.object_key()
         entry = self.conn.getPrevious(key).wait()
         if not entry or not entry.key.startswith(key[:-1]):
             self._metadata = {}  # mark object as "open"
+            self._head_known, self._head_key = True, None
             return
-        self.data_file = '.ts.' not in entry.key
-        blob = entry.value
-        self._nonce = get_nonce(entry.key)
-        self._metadata = msgpack.unpackb(blob)
+        metadata = msgpack.unpackb(entry.value)
+        head = (entry.key, metadata, metadata.pop(INLINE_DATA_KEY, None))
+        if self.head_cache is not None:
+            self.head_cache.set(self._head_cache_key, head,
+                                len(entry.key) + len(entry.value),
+                                generation)
+        self._load_head(*head)
+
+    def _load_head(self, head_key, metadata, inline_data):
+        self._head_known, self._head_key = True, head_key
+        self.data_file = '.ts.' not in head_key
+        self._nonce = get_nonce(head_key)
+        # the cached copy is shared, callers are free to change theirs
+        self._metadata = dict(metadata)
+        self._inline_data = inline_data
 
     def open(self, **kwargs):
         self._read()
@@ -195,23 +849,111 @@ class DiskFile(diskfile.DiskFile):
         if not self._took_reader:
             self.close()
 
+    @property
+    def chunk_count(self):
+        """
+        The number of chunks in the object, including the inline data.
+        """
+        count = int(self._metadata['X-Kinetic-Chunk-Count'])
+        return count + 1 if self._inline_data else count
+
+    def locate(self, offset):
+        """
+        Find the chunk holding a byte offset into the object, chunk zero is
+        the inline data if the head key has any.
+
+        :returns: a tuple, (chunk_id, offset into the chunk)
+        """
+        if not self._inline_data:
+            return divmod(offset, self.disk_chunk_size)
+        if offset < len(self._inline_data):
+            return 0, offset
+        q, r = divmod(offset - len(self._inline_data), self.disk_chunk_size)
+        return q + 1, r
+
+    def plan_range(self, start, stop):
+        """
+        Work out which chunks hold the bytes from start up to stop.
+
+        :returns: a list of (chunk_id, start, stop) tuples, the slice to
+                  take from each chunk
+        """
+        start = start or 0
+        last = self.chunk_count - 1
+        if stop is None:
+            end = None
+        elif stop <= start:
+            return []
+        else:
+            last_id, end = self.locate(stop - 1)
+            if last_id < last:
+                last, end = last_id, end + 1
+            elif last_id == last:
+                end += 1
+            else:
+                end = None
+        first, offset = self.locate(start)
+        return [(chunk_id, offset if chunk_id == first else 0,
+                 end if chunk_id == last else None)
+                for chunk_id in range(first, last + 1)]
+
+    def chunk_key(self, chunk_id):
+        if self._inline_data:
+            return chunk_key(self.hashpath, self._nonce, chunk_id)
+        return chunk_key(self.hashpath, self._nonce, chunk_id + 1)
+
     def keys(self):
-        return [chunk_key(self.hashpath, self._nonce, i + 1) for i in
-                range(self.chunk_id,
-                      int(self._metadata['X-Kinetic-Chunk-Count']))]
+        return [self.chunk_key(i) for i in range(self.chunk_count)
+                if i or not self._inline_data]
+
+    def iter_chunks(self, chunk_ids):
+        """
+        Pipelined read of the given chunks, in order.
+
+        The values are handed back as the client read them off the wire,
+        without a copy, see to_str.  Chunks in the chunk cache aren't
+        read from the drive at all.
+        """
+        chunk_ids = list(chunk_ids)
+        cached = {}
+        if self.chunk_cache is not None:
+            for chunk_id in chunk_ids:
+                if chunk_id or not self._inline_data:
+                    value = self.chunk_cache.get(self.chunk_key(chunk_id))
+                    if value is not None:
+                        cached[chunk_id] = value
+
+        def iter_keys():
+            for chunk_id in chunk_ids:
+                if chunk_id not in cached and (
+                        chunk_id or not self._inline_data):
+                    yield self.chunk_key(chunk_id)
+
+        results = self.conn.get_many(iter_keys(), depth=self.read_depth)
+        for chunk_id in chunk_ids:
+            if not chunk_id and self._inline_data:
+                yield self._inline_data
+                continue
+            if chunk_id in cached:
+                yield cached[chunk_id]
+                continue
+            key, entry, err = next(results)
+            if err:
+                raise err
+            if not entry:
+                # a cached head key may have outlived its chunks, fail the
+                # read rather than send a short body
+                self._invalidate_head()
+                raise diskfile.DiskFileError('Missing chunk %s' % key)
+            if self.chunk_cache is not None:
+                self.chunk_cache.add(key, entry.value)
+            yield entry.value
 
     def __iter__(self):
         if not self._metadata:
             return
-        pending = deque()
-        for key in self.keys():
-            while len(pending) >= self.read_depth:
-                entry = pending.popleft().wait()
-                yield str(entry.value) if entry else ''
-            pending.append(self.conn.get(key))
-        for resp in pending:
-            entry = resp.wait()
-            yield str(entry.value) if entry else ''
+        for chunk in self.iter_chunks(range(self.chunk_count)):
+            yield chunk
 
     @contextmanager
     def create(self, size=None):
@@ -219,6 +961,9 @@ class DiskFile(diskfile.DiskFile):
         # initialize the temp marker
         self._temp_marker = None
         self._chunk_id = 0
+        self._inline_data = None
+        self._buffer = ChunkBuffer()
+        self.upload_size = 0
         try:
             self._pending_write = deque()
             yield self
@@ -231,23 +976,57 @@ class DiskFile(diskfile.DiskFile):
     def write_metadata(self, metadata):
         raise NotImplementedError()
 
+    def _can_batch(self):
+        """
+        An upload that hasn't written any chunks yet, and would fit into a
+        single batch with its head key, is held in the buffer so put can
+        commit it atomically.
+        """
+        if self._chunk_id or not self.upload_size:
+            return False
+        num_chunks = -(-self.upload_size // self.disk_chunk_size)
+        return (self.upload_size <= self.batch_max_bytes and
+                num_chunks + 1 <= self.batch_max_ops)
+
+    def _take_inline(self, final=False):
+        """
+        Set aside the first inline_max_bytes of the upload for the head key.
+        Until the upload is final we wait for more than that to arrive, so
+        that objects smaller than inline_max_bytes are kept whole.
+        """
+        if self._inline_data is not None or not self.inline_max_bytes:
+            return
+        if final or len(self._buffer) > self.inline_max_bytes:
+            inline_data = self._buffer.take(self.inline_max_bytes)
+            if isinstance(inline_data, memoryview):
+                inline_data = inline_data.tobytes()
+            self._inline_data = bytes(inline_data)
+
     def write(self, chunk):
-        self._buffer.extend(chunk)
+        self._buffer.append(chunk)
         self.upload_size += len(chunk)
+        if self._can_batch():
+            return self.upload_size
 
-        diff = self.upload_size - self.last_sync
-        if diff >= self.disk_chunk_size:
+        self._take_inline()
+        if self.inline_max_bytes and self._inline_data is None:
+            return self.upload_size
+        while len(self._buffer) >= self.disk_chunk_size:
             self._sync_buffer()
-            self.last_sync = self.upload_size
         return self.upload_size
 
+    def _write_synchronization(self, final=True):
+        if self.synchronization == Synchronization.FLUSH and not (
+                final and self.group_commit is None):
+            return Synchronization.WRITEBACK
+        return self.synchronization
+
     def _submit_write(self, key, blob, final=True):
-        if len(self._pending_write) >= self.write_depth:
+        depth = self._depth(self.write_depth, 'write')
+        while len(self._pending_write) >= depth:
             self._pending_write.popleft().wait()
-        if self.synchronization == Synchronization.FLUSH and not final:
-            synchronization = Synchronization.WRITEBACK
-        else:
-            synchronization = self.synchronization
+            depth = self._depth(self.write_depth, 'write')
+        synchronization = self._write_synchronization(final)
         pending_resp = self.conn.put(key, blob, force=True,
                                      synchronization=synchronization)
         self._pending_write.append(pending_resp)
@@ -266,9 +1045,8 @@ class DiskFile(diskfile.DiskFile):
             # write out the chunk buffer!
             self._chunk_id += 1
             key = chunk_key(self.hashpath, self._nonce, self._chunk_id)
-            self._submit_write(key, self._buffer[:self.disk_chunk_size],
+            self._submit_write(key, self._buffer.take(self.disk_chunk_size),
                                final=False)
-        self._buffer = self._buffer[self.disk_chunk_size:]
 
     def _wait_write(self):
         for resp in self._pending_write:
@@ -281,71 +1059,203 @@ class DiskFile(diskfile.DiskFile):
             deleter._extension = '.ts'
             deleter.put({'X-Timestamp': timestamp})
 
+    def _batch_chunks(self):
+        """
+        Drain the buffer into (chunk_key, chunk) pairs for a batch.
+        """
+        puts = []
+        while self._buffer:
+            self._chunk_id += 1
+            puts.append((chunk_key(self.hashpath, self._nonce, self._chunk_id),
+                         self._buffer.take(self.disk_chunk_size)))
+        return puts
+
+    def _commit_batch(self, puts):
+        """
+        Commit the chunks and head key of an upload in a single batch.  If
+        the batch can't be committed nothing of it landed, so the keys are
+        written as a normal streamed upload instead.
+        """
+        try:
+            self.conn.batch(
+                puts, force=True,
+                synchronization=self._write_synchronization()).wait()
+            return
+        except Exception as e:
+            self.logger.warning(
+                'Unable to commit batch of %d keys to drive %s:%s (%s), '
+                'writing them one at a time' % (
+                    len(puts), self.conn.host, self.conn.port, e))
+            self.logger.increment('batch.fallback')
+        self._make_temp_marker()
+        for key, value in puts[:-1]:
+            self._submit_write(key, value, final=False)
+        key, value = puts[-1]
+        self._submit_write(key, value, final=True)
+
     def put(self, metadata):
         if self._extension == '.ts':
             metadata['deleted'] = True
-        self._sync_buffer()
-        while self._buffer:
+        self._take_inline(final=True)
+        # the chunks and head key of a small upload go in one atomic batch,
+        # no temp marker is needed because either all of it lands or none
+        batch = self._batch_chunks() if self._can_batch() else None
+        if batch is None:
             self._sync_buffer()
+            while self._buffer:
+                self._sync_buffer()
         # zero index, chunk-count is len
         metadata['X-Kinetic-Chunk-Count'] = self._chunk_id
         metadata['X-Kinetic-Chunk-Nonce'] = self._nonce
         metadata['name'] = self._name
         self._metadata = metadata
-        blob = msgpack.packb(self._metadata)
+        if self._inline_data:
+            blob = msgpack.packb(dict(metadata, **{
+                INLINE_DATA_KEY: self._inline_data}))
+        else:
+            blob = msgpack.packb(metadata)
         timestamp = diskfile.Timestamp(metadata['X-Timestamp'])
         frag_index = metadata.get('X-Object-Sysmeta-Ec-Frag-Index')
         key = self.object_key(timestamp.internal, frag_index=frag_index)
-        self._submit_write(key, blob, final=True)
-        self._wait_write()
-        if self.unlink_wait:
-            self._unlink_old(timestamp)
+        try:
+            if batch:
+                batch.append((key, blob))
+                self._commit_batch(batch)
+            else:
+                self._submit_write(key, blob, final=True)
+            self._wait_write()
+            if self.group_commit is not None:
+                self.group_commit.wait(self.conn)
+        finally:
+            self._invalidate_head()
+        # if this diskfile was opened and found nothing there are no older
+        # versions to look for, just the temp marker to clean up
+        scan = not self._head_known or self._head_key is not None
+        self._head_known, self._head_key = True, key
+        temp_markers = [self._temp_marker] if self._temp_marker else []
+        if not (scan or temp_markers):
+            self.logger.increment('cleanup.skipped')
+        elif self.unlink_wait or not self._manager.cleanup_queue.add(
+                self._head_cache_key, timestamp,
+                temp_markers=temp_markers, scan=scan):
+            self._unlink_old(timestamp, temp_markers=temp_markers, scan=scan)
+
+    def _unlink_old(self, req_timestamp, temp_markers=(), scan=True):
+        """
+        Remove the temp markers of finished uploads and, when scan is set,
+        every version of the object older than req_timestamp.  This is
+        background work so it's sent at the cleanup_priority.
+        """
+        if scan:
+            start_key = self.object_key()[:-1]
+            end_key = object_key(self.policy, self.hashpath,
+                                 timestamp=req_timestamp.internal,
+                                 extension='')
+            head_keys = list(self.conn.iterKeyRange(
+                start_key, end_key, priority=self.cleanup_priority))
         else:
-            spawn_n(self._unlink_old, timestamp)
-
-    def _unlink_old(self, req_timestamp):
-        pending = deque()
-        # clean-up temp marker
-        if self._temp_marker:
-            pending.append(self.conn.delete(self._temp_marker, force=True))
-        start_key = self.object_key()[:-1]
-        end_key = self.object_key(timestamp=req_timestamp.internal)
-        end_key = object_key(self.policy, self.hashpath,
-                             timestamp=req_timestamp.internal, extension='')
-        head_keys = list(self.conn.iterKeyRange(
-            start_key, end_key))
-        for head_key in head_keys:
-            nonce = get_nonce(head_key)
-
-            def key_gen():
+            head_keys = []
+
+        def key_gen():
+            for temp_marker in temp_markers:
+                yield temp_marker
+            for head_key in head_keys:
+                nonce = get_nonce(head_key)
                 start_key = chunk_key(self.hashpath, nonce, 0)
                 end_key = chunk_key(self.hashpath, nonce)
-                for key in self.conn.iterKeyRange(start_key, end_key):
+                for key in self.conn.iterKeyRange(
+                        start_key, end_key, priority=self.cleanup_priority):
                     yield key
                 yield head_key
 
-            for key in key_gen():
-                while len(pending) >= self.delete_depth:
-                    found = pending.popleft().wait()
-                    if not found:
-                        break
-                pending.append(self.conn.delete(key, force=True))
-
-        for resp in pending:
-            resp.wait()
+        for key, found, err in self.conn.delete_batched(
+                key_gen(), depth=self.delete_depth, force=True,
+                priority=self.cleanup_priority):
+            if err:
+                self.logger.error('Unable to remove old key %r: %s' % (
+                    key, err))
 
     def quarantine(self):
+        """
+        Move the object's keys under a quarantine prefix.
+
+        The chunks are copied first, then the quarantined head key is
+        written and the live one removed (in a single batch if the drive
+        supports it), and only then are the live chunks deleted.  Until the
+        head keys are swapped the object is untouched, after that a temp
+        marker covers the live chunks so the replicator cleans them up if
+        we don't get to finish.  Errors are logged per key, if any key
+        couldn't be copied the copies are removed again and the first error
+        is raised.
+        """
         timestamp = diskfile.Timestamp(self._metadata['X-Timestamp'])
         frag_index = self._metadata.get('X-Object-Sysmeta-Ec-Frag-Index')
         head_key = self.object_key(timestamp.internal, frag_index=frag_index)
-        keys = [head_key] + [
+        chunk_keys = [
             chunk_key(self.hashpath, self._nonce, i + 1) for i in
             range(int(self._metadata['X-Kinetic-Chunk-Count']))]
         quarantine_prefix = 'quarantine.%s.' % diskfile.Timestamp(
             time.time()).internal
-        for key in keys:
-            resp = self.conn.rename(key, quarantine_prefix + key)
-            resp.wait()
+        try:
+            self._quarantine(head_key, chunk_keys, quarantine_prefix)
+        finally:
+            self._invalidate_head()
+
+    def _quarantine(self, head_key, chunk_keys, quarantine_prefix):
+        errors = []
+
+        def log_error(key, err):
+            self.logger.error('Unable to quarantine key %r: %s' % (key, err))
+            errors.append(err)
+
+        heads = []
+
+        def iter_copies():
+            for key, entry, err in self.conn.get_many(
+                    [head_key] + chunk_keys, depth=self.read_depth):
+                if err:
+                    log_error(key, err)
+                elif not entry:
+                    continue
+                elif key == head_key:
+                    # the head is written last
+                    heads.append((quarantine_prefix + key, entry.value))
+                else:
+                    yield quarantine_prefix + key, entry.value
+
+        copied = []
+        for key, resp, err in self.conn.put_many(
+                iter_copies(), depth=self.write_depth, force=True):
+            if err:
+                log_error(key, err)
+            else:
+                copied.append(key)
+        if errors:
+            # leave the object as it was
+            for key, found, err in self.conn.delete_batched(
+                    copied, depth=self.delete_depth, force=True):
+                if err:
+                    self.logger.error('Unable to remove partial quarantine '
+                                      'key %r: %s' % (key, err))
+            raise errors[0]
+
+        temp_marker = temp_key(self.policy, self.hashpath, self._nonce)
+        puts = [(temp_marker, '')] + heads
+        if self.batch_max_ops >= len(puts) + 1:
+            self.conn.batch(puts=puts, deletes=[head_key],
+                            force=True).wait()
+        else:
+            for key, resp, err in self.conn.put_many(puts, force=True):
+                if err:
+                    raise err
+            self.conn.delete(head_key, force=True).wait()
+
+        for key, found, err in self.conn.delete_batched(
+                chunk_keys, depth=self.delete_depth, force=True):
+            if err:
+                log_error(key, err)
+        if not errors:
+            self.conn.delete(temp_marker, force=True).wait()
 
     def get_data_file_size(self):
         return self._metadata['Content-Length']
@@ -360,22 +1270,117 @@ class DiskFileManager(diskfile.DiskFileManager):
         self.connect_timeout = int(conf.get('connect_timeout', 3))
         self.response_timeout = int(conf.get('response_timeout', 30))
         self.connect_retry = int(conf.get('connect_retry', 3))
-        self.write_depth = int(conf.get('write_depth', DEFAULT_DEPTH))
-        self.read_depth = int(conf.get('read_depth', DEFAULT_DEPTH))
-        self.delete_depth = int(conf.get('delete_depth', DEFAULT_DEPTH))
+        # the Kinetic priority of each daemon's requests, old versions are
+        # cleaned up at cleanup_priority
+        self.priority = parse_priority(conf.get('priority', DEFAULT_PRIORITY))
+        self.cleanup_priority = parse_priority(conf.get(
+            'cleanup_priority', DEFAULT_CLEANUP_PRIORITY))
+        # once max_in_flight requests are on the wire the rest are queued
+        # highest priority first on each connection; 0 puts every request
+        # on the wire as soon as it's made, then priorities are only a
+        # hint in the request header for the drive
+        self.max_in_flight = int(conf.get('max_in_flight',
+                                          DEFAULT_MAX_IN_FLIGHT))
+        # consecutive failed connects before a drive's circuit breaker
+        # opens and connects to it fail fast
+        self.breaker_threshold = int(conf.get('breaker_threshold',
+                                              self.connect_retry))
+        self.breaker_probe_interval = float(conf.get(
+            'breaker_probe_interval', DEFAULT_BREAKER_PROBE_INTERVAL))
+        self.breaker_max_probe_interval = float(conf.get(
+            'breaker_max_probe_interval', DEFAULT_BREAKER_MAX_PROBE_INTERVAL))
+        self.breakers = {}
+        self.key_range_prefetch = int(conf.get('key_range_prefetch',
+                                               DEFAULT_PREFETCH))
+        # with adaptive_depth the *_depth options (default 8) are upper
+        # bounds on per-drive read, write and delete windows that float
+        # down to min_depth, without it they're fixed (default 2)
+        self.adaptive_depth = server.config_true_value(
+            conf.get('adaptive_depth', 'true'))
+        default_depth = DEFAULT_MAX_DEPTH if self.adaptive_depth else \
+            DEFAULT_DEPTH
+        self.write_depth = int(conf.get('write_depth', default_depth))
+        self.read_depth = int(conf.get('read_depth', default_depth))
+        self.delete_depth = int(conf.get('delete_depth', default_depth))
+        self.min_depth = max(1, int(conf.get('min_depth', 1)))
+        self.target_latency = float(conf.get('target_latency',
+                                             DEFAULT_TARGET_LATENCY))
+        self.depth_controllers = {}
+        self.connections_per_device = max(1, int(conf.get(
+            'connections_per_device', DEFAULT_CONNECTIONS_PER_DEVICE)))
+        # concurrent identical reads to a drive share one request
+        self.coalesce_reads = server.config_true_value(
+            conf.get('coalesce_reads', 'true'))
+        self.single_flights = {}
         raw_sync_option = conf.get('synchronization', 'writeback').lower()
         try:
             self.synchronization = SYNC_OPTION_MAP[raw_sync_option]
         except KeyError:
             raise ValueError('Invalid synchronization option, choices are %r' %
                              SYNC_OPTION_MAP.keys())
+        # with synchronization = flush concurrent PUTs to a drive share one
+        # flush, sent group_commit_window seconds after the first is written
+        self.group_commit = server.config_true_value(
+            conf.get('group_commit', 'false')) and \
+            self.synchronization == Synchronization.FLUSH
+        self.group_commit_window = float(conf.get(
+            'group_commit_window', DEFAULT_GROUP_COMMIT_WINDOW))
+        self.group_commits = {}
+        # requests to a drive that already has admission_max_ops requests
+        # or admission_max_bytes of writes in flight get a 503, 0 disables
+        self.admission_max_ops = int(conf.get('admission_max_ops', 0))
+        self.admission_max_bytes = int(conf.get('admission_max_bytes', 0))
+        self.admission_queue_size = int(conf.get(
+            'admission_queue_size', DEFAULT_ADMISSION_QUEUE_SIZE))
+        self.admission_queue_timeout = float(conf.get(
+            'admission_queue_timeout', DEFAULT_ADMISSION_QUEUE_TIMEOUT))
+        self.admissions = {}
+        self.batch_commit = server.config_true_value(
+            conf.get('batch_commit', 'true'))
+        self.batch_max_ops = int(conf.get('batch_max_ops',
+                                          DEFAULT_BATCH_MAX_OPS))
+        self.batch_max_bytes = int(conf.get('batch_max_bytes',
+                                            DEFAULT_BATCH_MAX_BYTES))
+        # 0 disables storing data in the head key
+        self.inline_max_bytes = int(conf.get('inline_max_bytes', 0))
+        # 0 disables caching head keys
+        head_cache_size = int(conf.get('head_cache_size', 0))
+        if head_cache_size > 0:
+            self.head_cache = HeadCache(
+                logger, head_cache_size,
+                max_bytes=int(conf.get('head_cache_max_bytes',
+                                       DEFAULT_HEAD_CACHE_MAX_BYTES)),
+                ttl=float(conf.get('head_cache_ttl',
+                                   DEFAULT_HEAD_CACHE_TTL)))
+        else:
+            self.head_cache = None
+        # 0 disables caching chunks
+        chunk_cache_max_bytes = int(conf.get('chunk_cache_max_bytes', 0))
+        if chunk_cache_max_bytes > 0:
+            self.chunk_cache = ChunkCache(
+                logger, chunk_cache_max_bytes,
+                doorkeeper_size=int(conf.get(
+                    'chunk_cache_doorkeeper_size',
+                    DEFAULT_CHUNK_CACHE_DOORKEEPER_SIZE)))
+        else:
+            self.chunk_cache = None
         self.conn_pool = {}
         self.unlink_wait = \
             server.config_true_value(conf.get('unlink_wait', 'false'))
+        self.cleanup_queue = CleanupQueue(
+            logger, self.cleanup_old_versions,
+            concurrency=max(1, int(conf.get('cleanup_concurrency',
+                                            DEFAULT_CLEANUP_CONCURRENCY))),
+            delay=float(conf.get('cleanup_delay', DEFAULT_CLEANUP_DELAY)),
+            max_pending=int(conf.get('cleanup_max_pending',
+                                     DEFAULT_CLEANUP_MAX_PENDING)))
 
     def get_diskfile(self, device, partition, account, container, obj, policy,
                      **kwargs):
         host, port = device.split(':')
+        admission = self.get_admission(host, port)
+        if admission is not None:
+            admission.admit()
         return DiskFile(self, host, port, self.threadpools[device],
                         partition, account, container, obj, policy=policy,
                         unlink_wait=self.unlink_wait,
@@ -395,6 +1400,25 @@ class DiskFileManager(diskfile.DiskFileManager):
                         policy=policy, _datadir=datadir,
                         unlink_wait=self.unlink_wait)
 
+    def cleanup_old_versions(self, key, timestamp, temp_markers=(),
+                             scan=True):
+        """
+        Run a cleanup pass queued by a DiskFile.  The pass gets a DiskFile
+        of its own, with whichever connection the pool hands out now, so a
+        faulted connection of the writer isn't reused.
+
+        :param key: the (device, policy index, hashpath) to clean up
+        :param timestamp: remove the versions older than this Timestamp
+        :param temp_markers: temp marker keys to remove
+        :param scan: False if there's no older version to look for
+        """
+        device, policy_index, hashpath = key
+        host, port = device.split(':')
+        df = DiskFile(self, host, port, self.threadpools[device], None,
+                      policy=POLICIES.get_by_index(policy_index),
+                      _datadir=hashpath, unlink_wait=True)
+        df._unlink_old(timestamp, temp_markers=temp_markers, scan=scan)
+
     def pickle_async_update(self, device, account, container, obj, data,
                             timestamp, policy_idx):
         host, port = device.split(':')
@@ -405,40 +1429,154 @@ class DiskFileManager(diskfile.DiskFileManager):
         resp.wait()
         self.logger.increment('async_pendings')
 
-    def _new_connection(self, host, port, **kwargs):
+    def get_depth_controllers(self, host, port):
+        """
+        The drive's depth controllers by op class, reads, writes and
+        deletes take very different times so each gets its own window.
+        """
+        if not self.adaptive_depth:
+            return {}
+        key = (host, port)
+        try:
+            return self.depth_controllers[key]
+        except KeyError:
+            pass
+        controllers = self.depth_controllers[key] = dict(
+            (op_class, DepthController(
+                '%s:%s.%s' % (host, port, op_class), self.logger,
+                target_latency=self.target_latency,
+                min_depth=self.min_depth, max_depth=max_depth))
+            for op_class, max_depth in (('read', self.read_depth),
+                                        ('write', self.write_depth),
+                                        ('delete', self.delete_depth)))
+        return controllers
+
+    def get_single_flight(self, host, port):
+        if not self.coalesce_reads:
+            return None
+        key = (host, port)
+        try:
+            return self.single_flights[key]
+        except KeyError:
+            flight = self.single_flights[key] = SingleFlight(self.logger)
+            return flight
+
+    def get_group_commit(self, host, port):
+        if not self.group_commit:
+            return None
+        key = (host, port)
+        try:
+            return self.group_commits[key]
+        except KeyError:
+            group_commit = self.group_commits[key] = GroupCommit(
+                '%s:%s' % key, self.logger, window=self.group_commit_window)
+            return group_commit
+
+    def get_admission(self, host, port):
+        if not (self.admission_max_ops or self.admission_max_bytes):
+            return None
+        key = (host, port)
+        try:
+            return self.admissions[key]
+        except KeyError:
+            admission = self.admissions[key] = AdmissionControl(
+                '%s:%s' % key, self.logger, max_ops=self.admission_max_ops,
+                max_bytes=self.admission_max_bytes,
+                queue_size=self.admission_queue_size,
+                queue_timeout=self.admission_queue_timeout)
+            return admission
+
+    def get_breaker(self, host, port):
+        key = (host, port)
+        try:
+            return self.breakers[key]
+        except KeyError:
+            breaker = self.breakers[key] = CircuitBreaker(
+                '%s:%s' % key, self.logger,
+                lambda: self._probe(host, port),
+                threshold=self.breaker_threshold,
+                probe_interval=self.breaker_probe_interval,
+                max_probe_interval=self.breaker_max_probe_interval)
+            return breaker
+
+    def _connect(self, host, port, **kwargs):
         kwargs.setdefault('connect_timeout', self.connect_timeout)
         kwargs.setdefault('response_timeout', self.response_timeout)
-        for i in range(1, self.connect_retry + 1):
-            try:
-                return KineticSwiftClient(self.logger, host, int(port),
-                                          **kwargs)
-            except Timeout:
-                self.logger.warning('Drive %s:%s connect timeout #%d (%ds)' % (
-                    host, port, i, self.connect_timeout))
-            except Exception:
-                self.logger.exception('Drive %s:%s connection error #%d' % (
-                    host, port, i))
-            if i < self.connect_retry:
-                sleep(1)
-        msg = 'Unable to connect to drive %s:%s after %s attempts' % (
-            host, port, i)
-        self.logger.error(msg)
+        kwargs.setdefault('prefetch', self.key_range_prefetch)
+        kwargs.setdefault('batch_max_ops', self.batch_max_ops
+                          if self.batch_commit else 0)
+        kwargs.setdefault('priority', self.priority)
+        kwargs.setdefault('max_in_flight', self.max_in_flight)
+        conn = KineticSwiftClient(self.logger, host, int(port), **kwargs)
+        conn.depth_controllers = self.get_depth_controllers(host, port)
+        conn.single_flight = self.get_single_flight(host, port)
+        conn.group_commit = self.get_group_commit(host, port)
+        conn.admission = self.get_admission(host, port)
+        return conn
+
+    def _probe(self, host, port):
+        # the probe's connection is as good as any other
+        conn = self._connect(host, port)
+        pool = self.conn_pool.setdefault((host, port), [])
+        if len(pool) < self.connections_per_device:
+            pool.append(conn)
+        else:
+            conn.close()
+
+    def _new_connection(self, host, port, **kwargs):
+        """
+        Connect to the drive at host:port, once.  Requests don't retry, a
+        drive that fails breaker_threshold connects in a row is left to the
+        drive's CircuitBreaker to probe in the background and until then
+        every connect fails fast.
+
+        :raises DiskFileDeviceUnavailable: if the drive can't be reached
+        """
+        try:
+            return self.get_breaker(host, port).call(
+                self._connect, host, port, **kwargs)
+        except CircuitOpen:
+            pass
+        except Timeout:
+            self.logger.warning('Drive %s:%s connect timeout (%ds)' % (
+                host, port, self.connect_timeout))
+        except Exception:
+            self.logger.exception('Drive %s:%s connection error' % (
+                host, port))
         raise diskfile.DiskFileDeviceUnavailable()
 
     def get_connection(self, host, port, **kwargs):
+        """
+        Pick a connection to the drive at host:port from the pool.
+
+        Each drive gets up to connections_per_device connections, new
+        connections are only opened when every healthy member of the pool
+        already has requests in flight.  Faulted members are dropped, and at
+        most one replacement is made per call so a flapping drive doesn't
+        tear down the rest of the pool.
+
+        :returns: the KineticSwiftClient with the fewest outstanding requests
+        """
         key = (host, port)
-        conn = None
-        try:
-            conn = self.conn_pool[key]
-        except KeyError:
-            pass
-        if conn and conn.faulted:
+        pool = self.conn_pool.setdefault(key, [])
+        for conn in [c for c in pool if c.faulted]:
+            pool.remove(conn)
             conn.close()
-            conn = None
-        if not conn:
-            conn = self.conn_pool[key] = self._new_connection(
-                host, port, **kwargs)
-        return conn
+        conn = min(pool, key=lambda c: c.outstanding) if pool else None
+        if conn and (not conn.outstanding or
+                     len(pool) >= self.connections_per_device):
+            return conn
+        try:
+            new_conn = self._new_connection(host, port, **kwargs)
+        except diskfile.DiskFileDeviceUnavailable:
+            if not conn:
+                raise
+            self.logger.warning('Unable to grow connection pool for drive '
+                                '%s:%s (%d connections)' % (
+                                    host, port, len(pool)))
+            return conn
+        pool.append(new_conn)
+        return new_conn
 
 
 class ECDiskFileManager(DiskFileManager):
@@ -473,6 +1611,16 @@ class ObjectController(server.ObjectController):
                 return orig_send(m_name, *args, **kwargs)
             self.logger.logger.statsd_client._send = _send
 
+    def get_diskfile(self, device, partition, account, container, obj,
+                     policy, **kwargs):
+        try:
+            return super(ObjectController, self).get_diskfile(
+                device, partition, account, container, obj, policy,
+                **kwargs)
+        except DriveBusy as e:
+            self.logger.increment('drive_busy')
+            raise HTTPServiceUnavailable(body=str(e))
+
 
 def app_factory(global_conf, **local_conf):
     install_kinetic_diskfile()
@@ -26,10 +26,12 @@ from swift.common.storage_policy import POLICIES
 from swift.common.swob import HeaderKeyDict
 from swift.common.utils import parse_options, list_from_csv
 from swift.obj.updater import ObjectUpdater, dump_recon_cache
-from swift.obj.diskfile import DiskFileDeviceUnavailable
+from swift.obj.diskfile import DiskFileDeviceUnavailable, get_async_dir
 from swift import gettext_ as _
 
 from kinetic_swift.obj.server import DiskFileManager
+from kinetic_swift.utils import (iter_sharded_key_range, DEFAULT_SCAN_SHARDS,
+                                 DEFAULT_SCAN_CONCURRENCY)
 
 
 class KineticUpdater(ObjectUpdater):
@@ -37,6 +39,10 @@ class KineticUpdater(ObjectUpdater):
     def __init__(self, *args, **kwargs):
         super(KineticUpdater, self).__init__(*args, **kwargs)
         self.mgr = DiskFileManager(self.conf, self.logger)
+        self.scan_shards = int(self.conf.get('scan_shards',
+                                             DEFAULT_SCAN_SHARDS))
+        self.scan_concurrency = int(self.conf.get('scan_concurrency',
+                                                  DEFAULT_SCAN_CONCURRENCY))
 
     def run_forever(self, *args, **kwargs):
         """Run the updater continuously."""
@@ -81,11 +87,13 @@ class KineticUpdater(ObjectUpdater):
                 self.stats['device.failures'] += 1
 
     def _find_updates_entries(self, device):
-        conn = self.mgr.get_connection(*device.split(':'))
-        start_key = 'async_pending'
-        end_key = 'async_pending/'
-        for async_key in conn.iterKeyRange(start_key, end_key):
-            yield async_key
+        host, port = device.split(':')
+        for policy in POLICIES:
+            for async_key in iter_sharded_key_range(
+                    lambda: self.mgr.get_connection(host, port),
+                    get_async_dir(policy), shards=self.scan_shards,
+                    concurrency=self.scan_concurrency, ordered=False):
+                yield async_key
 
     def object_sweep(self, device):
         self.logger.debug('Search async_pending on %r', device)
@@ -13,6 +13,9 @@
 
 import errno
 
+from eventlet import GreenPool, spawn
+from eventlet.queue import Queue
+from greenlet import GreenletExit
 from swift import gettext_ as _
 from swift.container.sync import ic_conf_body
 from swift.common.wsgi import ConfigString
@@ -53,3 +56,117 @@ def key_range_markers(marker):
     :returns: a tuple, (start_key, end_key)
     """
     return tuple(marker + m for m in ('.', '/'))
+
+
+DEFAULT_SCAN_SHARDS = 16
+DEFAULT_SCAN_CONCURRENCY = 4
+
+_SHARD_DONE = object()
+
+
+def shard_key_range_markers(marker, shards=DEFAULT_SCAN_SHARDS):
+    """
+    Hashpaths are uniformly distributed hex, so the key space under a
+    "path" can be split into contiguous sub-ranges on the leading hex
+    digits of the hashpath that follows it.
+
+    :param marker: the first segment of the key space
+    :param shards: the number of sub-ranges, a power of 16
+
+    :returns: a list of (start_key, end_key) tuples in key order, the
+              end_key of each range is exclusive
+    """
+    start_key, end_key = key_range_markers(marker)
+    if shards <= 1:
+        return [(start_key, end_key)]
+    width = len('%x' % (shards - 1))
+    if 16 ** width != shards:
+        raise ValueError('shards must be a power of 16, not %r' % shards)
+    bounds = [start_key] + [start_key + '%0*x' % (width, i)
+                            for i in range(1, shards)] + [end_key]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def iter_sharded_key_range(get_conn, marker, shards=DEFAULT_SCAN_SHARDS,
+                           concurrency=DEFAULT_SCAN_CONCURRENCY,
+                           ordered=True, reverse=False, queue_size=1000,
+                           end_key=None, **kwargs):
+    """
+    Scan the key space under marker as shard_key_range_markers sub-ranges,
+    with up to concurrency of them in flight at once.
+
+    :param get_conn: a callable returning a KineticSwiftClient, called once
+                     per sub-range so scans can be spread over connections
+    :param marker: the first segment of the key space
+    :param shards: the number of sub-ranges, a power of 16
+    :param concurrency: the number of sub-ranges to scan at once
+    :param ordered: if True keys are yielded in key order (reverse key order
+                    if reverse), otherwise as they arrive; either way all of
+                    the keys for a hashpath come from the same sub-range in
+                    order
+    :param reverse: scan each sub-range (and the sub-ranges) in reverse
+    :param queue_size: how many keys each sub-range may buffer ahead of
+                       the caller
+    :param end_key: if given only keys before it are scanned
+    """
+    ranges = shard_key_range_markers(marker, shards)
+    if end_key is not None:
+        ranges = [(start_key, min(stop_key, end_key))
+                  for start_key, stop_key in ranges if start_key < end_key]
+    if reverse:
+        ranges.reverse()
+    if ordered:
+        queues = [Queue(queue_size) for r in ranges]
+    else:
+        queues = [Queue(queue_size)] * len(ranges)
+    pool = GreenPool(max(1, concurrency))
+    threads = []
+
+    def scan(queue, start_key, end_key):
+        try:
+            conn = get_conn()
+            for key in conn.iterKeyRange(start_key, end_key, reverse=reverse,
+                                         endKeyInclusive=False, **kwargs):
+                queue.put(key)
+        except GreenletExit:
+            raise
+        except BaseException as e:
+            # anything else (like a Timeout) is passed on, or the caller
+            # would wait forever for the sub-range to finish
+            queue.put(e)
+        else:
+            queue.put(_SHARD_DONE)
+
+    def spawn_scans():
+        for queue, key_range in zip(queues, ranges):
+            threads.append(pool.spawn(scan, queue, *key_range))
+
+    threads.append(spawn(spawn_scans))
+    try:
+        done = 0
+        while done < len(ranges):
+            item = queues[done if ordered else 0].get()
+            if item is _SHARD_DONE:
+                done += 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+    finally:
+        for thread in threads:
+            thread.kill()
+
+
+def gauge(logger, metric, value):
+    """
+    Swift's LogAdapter doesn't expose StatsD gauges, so reach around it to
+    the underlying statsd client when there is one.
+
+    :param logger: a swift LogAdapter
+    :param metric: the metric name (without the statsd prefix)
+    :param value: the current value of the gauge
+    """
+    statsd_client = getattr(getattr(logger, 'logger', None),
+                            'statsd_client', None)
+    if statsd_client:
+        statsd_client._send(metric, value, 'g', 1)
@@ -20,6 +20,7 @@ import msgpack
 from swift.common.storage_policy import POLICIES
 
 from swift.obj.diskfile import DiskFileDeleted
+from kinetic_swift.client import PRIORITY_CLASSES
 from kinetic_swift.obj import auditor, server
 
 from utils import (KineticSwiftTestCase, debug_logger)
@@ -63,6 +64,12 @@ class TestKineticObjectAuditor(KineticSwiftTestCase):
             self.assert_('unable to connect' in msg)
             self.assert_(self.device in msg)
 
+    def test_priority(self):
+        conn = self.auditor.mgr.get_connection(*self.device.split(':'))
+        self.assertEqual(conn.priority, PRIORITY_CLASSES['lowest'])
+        daemon = auditor.KineticAuditor({'priority': 'lower'})
+        self.assertEqual(daemon.mgr.priority, PRIORITY_CLASSES['lower'])
+
     def test_put_and_audit(self):
         df = self.auditor.mgr.get_diskfile(self.device, '0', 'a', 'c',
                                            self.buildKey('o'), self.policy)
@@ -1,4 +1,74 @@
-from utils import KineticSwiftTestCase
+import unittest
+
+import eventlet
+from kinetic.common import Priority
+
+from kinetic_swift.client import (KineticSwiftClient, SingleFlight, Response,
+                                  CircuitBreaker, CircuitOpen,
+                                  DEFAULT_MAX_IN_FLIGHT)
+from kinetic_swift.utils import (shard_key_range_markers,
+                                 iter_sharded_key_range)
+
+from utils import KineticSwiftTestCase, debug_logger
+
+
+class TestShardKeyRangeMarkers(unittest.TestCase):
+
+    def test_shard_markers(self):
+        self.assertEqual([('objects.', 'objects/')],
+                         shard_key_range_markers('objects', 1))
+        ranges = shard_key_range_markers('objects', 16)
+        self.assertEqual(16, len(ranges))
+        self.assertEqual(('objects.', 'objects.1'), ranges[0])
+        self.assertEqual(('objects.9', 'objects.a'), ranges[9])
+        self.assertEqual(('objects.f', 'objects/'), ranges[-1])
+        ranges = shard_key_range_markers('objects', 256)
+        self.assertEqual(256, len(ranges))
+        self.assertEqual(('objects.', 'objects.01'), ranges[0])
+        self.assertEqual(('objects.ff', 'objects/'), ranges[-1])
+        # contiguous
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+
+    def test_shard_markers_invalid(self):
+        self.assertRaises(ValueError, shard_key_range_markers, 'objects', 10)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_probe_and_close(self):
+        probes = []
+
+        def probe():
+            probes.append(True)
+            if len(probes) < 2:
+                raise IOError('still down')
+
+        def connect():
+            raise IOError('down')
+
+        logger = debug_logger()
+        breaker = CircuitBreaker('localhost:9123', logger, probe,
+                                 threshold=2, probe_interval=0.01)
+        # failures under the threshold are let through
+        self.assertRaises(IOError, breaker.call, connect)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertRaises(IOError, breaker.call, connect)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        # then connects fail fast
+        self.assertRaises(CircuitOpen, breaker.call, connect)
+        self.assertEqual(breaker.rejected, 1)
+        # until a probe gets through
+        while breaker.state != breaker.CLOSED:
+            eventlet.sleep(0.01)
+        self.assertEqual(len(probes), 2)
+        self.assertEqual(breaker.call(lambda: 'conn'), 'conn')
+        self.assertEqual(logger.get_increment_counts(), {
+            'circuit_breaker.open': 2,
+            'circuit_breaker.half_open': 2,
+            'circuit_breaker.closed': 1,
+            'circuit_breaker.rejected': 1,
+        })
 
 
 class TestKineticSwiftClient(KineticSwiftTestCase):
@@ -48,3 +118,338 @@ class TestKineticSwiftClient(KineticSwiftTestCase):
             'objects.asdf.000',
         ], list(self.client.iterKeyRange(
             'objects.', 'objects/', maxReturned=2, reverse=True))[-4:])
+
+    def test_iter_keys_adaptive_page_size(self):
+        expected = []
+        for i in range(40):
+            key = 'objects.asdf.%03d' % i
+            self.client.put(key, '')
+            expected.append(key)
+
+        page_sizes = []
+        orig_get_key_range = self.client.conn.getKeyRangeAsync
+
+        def capture_page_size(*args, **kwargs):
+            page_sizes.append(kwargs['maxReturned'])
+            return orig_get_key_range(*args, **kwargs)
+
+        self.client.conn.getKeyRangeAsync = capture_page_size
+        self.client.min_key_range = 2
+        self.client.max_key_range = 16
+        for prefetch in (0, 1, 3):
+            page_sizes[:] = []
+            self.assertEqual(expected, list(self.client.iterKeyRange(
+                'objects.', 'objects/', prefetch=prefetch)))
+            self.assertEqual(page_sizes[:4], [2, 4, 8, 16])
+            self.assertEqual(max(page_sizes), 16)
+
+    def test_iter_keys_prefetch_stops_early(self):
+        for i in range(13):
+            key = 'objects.asdf.%03d' % i
+            self.client.put(key, '')
+
+        pages = []
+        orig_get_key_range = self.client.conn.getKeyRangeAsync
+
+        def capture_page(*args, **kwargs):
+            pages.append(args[2:])
+            return orig_get_key_range(*args, **kwargs)
+
+        self.client.conn.getKeyRangeAsync = capture_page
+        key_iter = self.client.iterKeyRange('objects.', 'objects/',
+                                            maxReturned=2, prefetch=2)
+        self.assertEqual('objects.asdf.000', next(key_iter))
+        key_iter.close()
+        # read ahead never gets more than prefetch pages ahead
+        self.assertLessEqual(len(pages), 3)
+
+    def test_iter_sharded_key_range(self):
+        expected = []
+        for i in range(64):
+            key = 'objects.%02x.%03d' % (i * 4, i)
+            self.client.put(key, '')
+            expected.append(key)
+        # some keys outside the range
+        self.client.put('objects-1.00.000', '')
+        self.client.put('objectsX', '')
+
+        def get_conn():
+            return self.client
+
+        for shards in (1, 16, 256):
+            self.assertEqual(expected, list(iter_sharded_key_range(
+                get_conn, 'objects', shards=shards, concurrency=3)))
+            self.assertEqual(expected[::-1], list(iter_sharded_key_range(
+                get_conn, 'objects', shards=shards, reverse=True)))
+            self.assertEqual(sorted(expected), sorted(iter_sharded_key_range(
+                get_conn, 'objects', shards=shards, ordered=False,
+                queue_size=1)))
+            # resume a reverse scan below a key
+            self.assertEqual(expected[:20][::-1], list(iter_sharded_key_range(
+                get_conn, 'objects', shards=shards, reverse=True,
+                end_key=expected[20])))
+
+    def test_iter_sharded_key_range_timeout(self):
+        class TimeoutConn(object):
+            def iterKeyRange(self, *args, **kwargs):
+                raise eventlet.Timeout()
+
+        # a scan that times out fails the iteration instead of hanging it
+        with eventlet.Timeout(5):
+            self.assertRaises(eventlet.Timeout, list, iter_sharded_key_range(
+                TimeoutConn, 'objects', shards=16))
+
+    def test_many(self):
+        items = [('objects.asdf.%03d' % i, 'value%s' % i) for i in range(20)]
+        results = list(self.client.put_many(items, depth=3))
+        self.assertEqual([k for k, v in items], [r[0] for r in results])
+        self.assertEqual([None] * 20, [r[2] for r in results])
+
+        keys = [k for k, v in items] + ['objects.asdf.missing']
+        results = list(self.client.get_many(keys, depth=3))
+        self.assertEqual(keys, [r[0] for r in results])
+        self.assertEqual([v for k, v in items],
+                         [r[1].value for r in results[:-1]])
+        self.assertEqual(None, results[-1][1])
+
+        results = list(self.client.get_many(keys, depth=3, ordered=False))
+        self.assertEqual(sorted(keys), sorted(r[0] for r in results))
+
+        results = list(self.client.delete_many(keys[::2], force=True))
+        self.assertEqual(keys[::2], [r[0] for r in results])
+        self.assertEqual(set([None]), set(r[2] for r in results))
+        remaining = list(self.client.iterKeyRange('objects.', 'objects/'))
+        self.assertEqual(keys[1:-1:2], remaining)
+
+    def test_many_per_key_errors(self):
+        keys = ['objects.asdf.%03d' % i for i in range(10)]
+        list(self.client.put_many((k, '') for k in keys))
+        orig_get = self.client.get
+
+        def broken_get(key, **kwargs):
+            if key == keys[3]:
+                raise Exception('broken')
+            return orig_get(key, **kwargs)
+
+        self.client.get = broken_get
+        for ordered in (True, False):
+            results = dict((k, (v, e)) for k, v, e in self.client.get_many(
+                keys, depth=2, ordered=ordered))
+            self.assertEqual(sorted(keys), sorted(results))
+            entry, err = results.pop(keys[3])
+            self.assertEqual(None, entry)
+            self.assertEqual('broken', str(err))
+            for entry, err in results.values():
+                self.assertEqual(None, err)
+
+    def test_single_flight(self):
+        self.client.put('objects.asdf', 'value').wait()
+        flight = self.client.single_flight = SingleFlight(debug_logger())
+        first = self.client.get('objects.asdf')
+        second = self.client.get('objects.asdf')
+        self.assertTrue(first is second)
+        previous = self.client.getPrevious('objects.asdg')
+        # reads with options aren't shared
+        self.assertFalse(self.client.get('objects.asdf', timeout=5000) is
+                         first)
+        self.assertEqual(first.wait().value, 'value')
+        self.assertEqual(second.wait().value, 'value')
+        self.assertEqual(previous.wait().key, 'objects.asdf')
+        self.assertEqual(flight.in_flight, {})
+        # once the response is back the next read goes to the drive
+        self.assertFalse(self.client.get('objects.asdf') is first)
+        self.assertEqual((flight.leaders, flight.coalesced), (3, 1))
+        self.assertEqual(flight.logger.get_increment_counts(), {
+            'single_flight.leader': 3, 'single_flight.coalesced': 1})
+        # a forgotten read isn't joined
+        third = self.client.get('objects.asdf')
+        flight.forget(('get', 'objects.asdf'))
+        self.assertFalse(self.client.get('objects.asdf') is third)
+
+    def test_batch_shares_connection(self):
+        # a batch's frames are written by the connection's writer like every
+        # other request, so they can't interleave on a shared connection
+        conn = self.client.conn
+        writers = []
+        orig_send = conn.network_send
+
+        def record_send(*args, **kwargs):
+            writers.append(eventlet.getcurrent() is conn.writer_thread)
+            return orig_send(*args, **kwargs)
+
+        self.client.put('objects.batch.old', '', force=True).wait()
+        conn.network_send = record_send
+        try:
+            batch = self.client.batch(
+                puts=[('objects.batch.%03d' % i, 'x' * 100)
+                      for i in range(5)],
+                deletes=['objects.batch.old'], force=True)
+            puts = [self.client.put('objects.single.%03d' % i, 'y' * 100,
+                                    force=True) for i in range(5)]
+            self.assertTrue(batch.wait())
+            for resp in puts:
+                resp.wait()
+        finally:
+            del conn.network_send
+        # start, 6 operations and end, plus the single puts
+        self.assertEqual([True] * 13, writers)
+        keys = list(self.client.iterKeyRange('objects.', 'objects/'))
+        self.assertEqual(10, len(keys))
+        self.assertFalse('objects.batch.old' in keys)
+
+    def test_close_after_batch(self):
+        # the drive doesn't answer a batch's operations, closing the
+        # connection mustn't wait for them
+        client = KineticSwiftClient(self.logger, 'localhost', self.PORTS[0])
+        batch = client.batch(puts=[('objects.batch.%03d' % i, 'x')
+                                   for i in range(5)],
+                             deletes=['objects.batch.old'], force=True)
+        self.assertTrue(batch.wait())
+        with eventlet.Timeout(5):
+            client.close()
+        self.assertEqual(None, client.conn)
+
+    def test_delete_batched(self):
+        keys = ['objects.asdf.%03d' % i for i in range(40)]
+        list(self.client.put_many((k, '') for k in keys))
+        batches = []
+        orig_batch = self.client.batch
+
+        def capture_batch(puts=(), deletes=(), **kwargs):
+            batches.append(list(deletes))
+            if len(batches) == 2:
+                # the whole batch fails, its keys are retried one by one
+                promise = Response(self.client)
+                promise.setError(Exception('batch aborted'))
+                return promise
+            return orig_batch(puts, deletes, **kwargs)
+
+        self.client.batch = capture_batch
+        self.client.batch_max_ops = 15
+        results = list(self.client.delete_batched(keys, force=True))
+        self.assertEqual(keys, [r[0] for r in results])
+        self.assertEqual([None] * 40, [r[2] for r in results])
+        self.assertEqual([15, 15, 10], [len(b) for b in batches])
+        self.assertEqual([], list(self.client.iterKeyRange('objects.',
+                                                           'objects/')))
+
+        # without batches keys are deleted one at a time
+        list(self.client.put_many((k, '') for k in keys))
+        batches[:] = []
+        self.client.batch_max_ops = 0
+        self.client.delete_keys(keys)
+        self.assertEqual([], batches)
+        self.assertEqual([], list(self.client.iterKeyRange('objects.',
+                                                           'objects/')))
+
+    def test_delete_batched_shares_connection(self):
+        keys = ['objects.asdf.%03d' % i for i in range(20)]
+        list(self.client.put_many((k, '') for k in keys))
+        conn = self.client.conn
+        writers = []
+        orig_send = conn.network_send
+
+        def record_send(*args, **kwargs):
+            writers.append(eventlet.getcurrent() is conn.writer_thread)
+            return orig_send(*args, **kwargs)
+
+        self.client.batch_max_ops = 5
+        conn.network_send = record_send
+        try:
+            deleter = eventlet.spawn(list, self.client.delete_batched(
+                keys, force=True))
+            puts = [self.client.put('objects.other.%03d' % i, 'x' * 100,
+                                    force=True) for i in range(10)]
+            results = deleter.wait()
+            for resp in puts:
+                resp.wait()
+        finally:
+            del conn.network_send
+        self.assertEqual([None] * 20, [r[2] for r in results])
+        self.assertTrue(writers)
+        self.assertTrue(all(writers))
+        self.assertEqual(
+            ['objects.other.%03d' % i for i in range(10)],
+            list(self.client.iterKeyRange('objects.', 'objects/')))
+
+    def test_close_after_delete_batched(self):
+        client = KineticSwiftClient(self.logger, 'localhost', self.PORTS[0])
+        keys = ['objects.asdf.%03d' % i for i in range(20)]
+        list(client.put_many((k, '') for k in keys))
+        client.batch_max_ops = 5
+        results = list(client.delete_batched(keys, force=True))
+        self.assertEqual([None] * 20, [r[2] for r in results])
+        with eventlet.Timeout(5):
+            client.close()
+        self.assertEqual(None, client.conn)
+        self.assertEqual([], list(self.client.iterKeyRange(
+            'objects.', 'objects/')))
+
+    def test_background_queued_behind_foreground(self):
+        client = KineticSwiftClient(self.logger, 'localhost', self.PORTS[0])
+        self.assertEqual(client.max_in_flight, DEFAULT_MAX_IN_FLIGHT)
+        sent = []
+
+        def record(name):
+            method = getattr(client.conn, name)
+
+            def send(*args, **kwargs):
+                sent.append((name, kwargs['priority']))
+                return method(*args, **kwargs)
+            setattr(client.conn, name, send)
+        for name in ('putAsync', 'getAsync', 'deleteAsync'):
+            record(name)
+        busy = [client.put('objects.%03d' % i, 'value')
+                for i in range(client.max_in_flight)]
+        background = client.delete('objects.000', priority=Priority.LOWEST)
+        foreground = client.get('objects.001')
+        self.assertEqual(len(client._queue), 2)
+        for resp in busy + [background, foreground]:
+            resp.wait()
+        # the foreground get went out first though it was made last
+        self.assertEqual(sent[client.max_in_flight:], [
+            ('getAsync', Priority.NORMAL),
+            ('deleteAsync', Priority.LOWEST),
+        ])
+        client.close()
+
+    def test_priority_queue(self):
+        client = KineticSwiftClient(self.logger, 'localhost', self.PORTS[0],
+                                    max_in_flight=1,
+                                    priority=Priority.LOWER)
+        sent = []
+
+        def record(name):
+            method = getattr(client.conn, name)
+
+            def send(*args, **kwargs):
+                sent.append((name, kwargs['priority']))
+                return method(*args, **kwargs)
+            setattr(client.conn, name, send)
+        for name in ('putAsync', 'getAsync', 'getPreviousAsync',
+                     'deleteAsync'):
+            record(name)
+        responses = [
+            client.put('objects.a', 'value'),
+            client.put('objects.b', 'value'),
+            client.delete('objects.c', priority=Priority.LOWEST),
+            client.getPrevious('objects.b'),
+            client.get('objects.a', priority=Priority.NORMAL),
+        ]
+        self.assertEqual((client.in_flight, len(client._queue)), (1, 4))
+        for resp in responses:
+            resp.wait()
+        # higher priorities first, and metadata ahead of values
+        self.assertEqual(sent, [
+            ('putAsync', Priority.LOWER),
+            ('getAsync', Priority.NORMAL),
+            ('getPreviousAsync', Priority.LOWER),
+            ('putAsync', Priority.LOWER),
+            ('deleteAsync', Priority.LOWEST),
+        ])
+        self.assertEqual(client.in_flight, 0)
+        # queued requests fail when the connection is closed
+        client.put('objects.d', 'value')
+        queued = client.get('objects.d')
+        client.close()
+        self.assertRaises(Exception, queued.wait)
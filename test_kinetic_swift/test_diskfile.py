@@ -11,18 +11,222 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import time
 import unittest
 import random
+import mock
+import eventlet
 
 from swift.common.utils import Timestamp
+from kinetic.common import IntegrityAlgorithms
 
-from kinetic_swift.client import KineticSwiftClient
+from kinetic_swift.client import (KineticSwiftClient, PRIORITY_CLASSES,
+                                  Response)
 from kinetic_swift.obj import server
+from kinetic_swift.utils import key_range_markers
 
 from utils import KineticSwiftTestCase, debug_logger
 
 
+class TestDepthController(unittest.TestCase):
+
+    def test_grow_and_shrink(self):
+        controller = server.DepthController('localhost:9123', debug_logger(),
+                                            target_latency=0.1, max_depth=8)
+        self.assertEqual(controller.depth, server.DEFAULT_DEPTH)
+        # fast responses open the window up to the max
+        for i in range(100):
+            controller.observe(0.01)
+        self.assertEqual(controller.depth, 8)
+        self.assertEqual(controller.bound(4), 4)
+        # a slow response cuts it in half
+        controller.observe(1.0)
+        self.assertEqual(controller.depth, 4)
+        # ... but only once per target latency
+        controller.observe(1.0)
+        self.assertEqual(controller.depth, 4)
+        # timeouts back off too, down to the min
+        for i in range(10):
+            controller.last_decrease = 0
+            controller.decrease()
+        self.assertEqual(controller.depth, 1)
+        self.assertEqual(controller.bound(4), 1)
+
+
+class TestGroupCommit(unittest.TestCase):
+
+    def test_flush_each_connection(self):
+        logger = debug_logger()
+        group_commit = server.GroupCommit('localhost:9123', logger,
+                                          window=0.01)
+        good_conn, bad_conn = mock.MagicMock(), mock.MagicMock()
+        bad_conn.flush.return_value.wait.side_effect = Exception('faulted')
+
+        def wait(conn):
+            try:
+                group_commit.wait(conn)
+            except Exception as e:
+                return str(e)
+            return 'ok'
+
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(wait, [good_conn, bad_conn, good_conn]))
+        # one flush per connection, only the writers on the connection
+        # that failed see the error
+        self.assertEqual(['ok', 'faulted', 'ok'], results)
+        self.assertEqual(1, good_conn.flush.call_count)
+        self.assertEqual(1, bad_conn.flush.call_count)
+        self.assertEqual(2, group_commit.flushes)
+        self.assertEqual(1, len(logger.get_lines_for_level('error')))
+
+
+class TestHeadCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = server.HeadCache(debug_logger(), 2, max_bytes=100, ttl=10)
+        cache.set('a', 'A', 10, cache.generation)
+        cache.set('b', 'B', 10, cache.generation)
+        self.assertEqual(cache.get('a'), 'A')
+        # b is the least recently used
+        cache.set('c', 'C', 10, cache.generation)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        # the byte limit evicts too
+        cache.set('d', 'D', 91, cache.generation)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 91)
+        # values bigger than the cache aren't kept
+        cache.set('e', 'E', 101, cache.generation)
+        self.assertEqual(cache.get('e'), None)
+        self.assertEqual(cache.get('d'), 'D')
+        self.assertEqual(cache.logger.get_increment_counts(),
+                         {'head_cache.hit': 3, 'head_cache.miss': 2})
+
+    def test_ttl_and_invalidate(self):
+        cache = server.HeadCache(debug_logger(), 10, ttl=10)
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            cache.set('a', 'A', 10, cache.generation)
+        with mock.patch('time.time', return_value=now + 11):
+            self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+        # a read that raced an invalidation isn't cached
+        generation = cache.generation
+        cache.invalidate('a')
+        cache.set('a', 'A', 10, generation)
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', 'A', 10, cache.generation)
+        cache.invalidate('a')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+    def test_zero_disables(self):
+        for kwargs in ({'max_bytes': 0}, {'ttl': 0}):
+            cache = server.HeadCache(debug_logger(), 10, **kwargs)
+            cache.set('a', 'A', 0, cache.generation)
+            cache.set('b', 'B', 10, cache.generation)
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(cache.get('b'), None)
+        # but only an explicit 0, the defaults apply otherwise
+        cache = server.HeadCache(debug_logger(), 10)
+        self.assertEqual(cache.max_bytes, server.DEFAULT_HEAD_CACHE_MAX_BYTES)
+        self.assertEqual(cache.ttl, server.DEFAULT_HEAD_CACHE_TTL)
+
+
+class TestChunkCache(unittest.TestCase):
+
+    def test_admission_and_eviction(self):
+        cache = server.ChunkCache(debug_logger(), 30, doorkeeper_size=2)
+        # the first miss is only remembered
+        self.assertEqual(cache.get('a'), None)
+        cache.add('a', 'A' * 10)
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.get('a'), None)
+        cache.add('a', 'A' * 10)
+        self.assertEqual(cache.get('a'), 'A' * 10)
+        # a stream of keys seen once doesn't get in
+        for key in 'bcde':
+            cache.add(key, key * 10)
+        self.assertEqual(len(cache), 1)
+        # ... and the doorkeeper only remembers the last few
+        cache.add('b', 'b' * 10)
+        self.assertFalse('b' in cache)
+        for key in 'ebc':
+            cache.add(key, key * 10)
+        self.assertEqual(sorted(cache._entries), ['a', 'b', 'e'])
+        self.assertEqual(cache.size, 30)
+        # the least recently used is evicted to stay under budget
+        cache.get('a')
+        cache.add('d', 'd' * 10)
+        cache.add('d', 'd' * 10)
+        self.assertEqual(sorted(cache._entries), ['a', 'b', 'd'])
+        # values bigger than the cache never get in
+        cache.add('f', 'f' * 31)
+        cache.add('f', 'f' * 31)
+        self.assertFalse('f' in cache)
+        self.assertEqual((cache.hits, cache.misses, cache.bytes_saved),
+                         (2, 2, 20))
+        self.assertEqual(cache.logger.get_increment_counts(),
+                         {'chunk_cache.hit': 2, 'chunk_cache.miss': 2})
+
+
+class TestAdmissionControl(unittest.TestCase):
+
+    def test_shed_and_queue(self):
+        admission = server.AdmissionControl(
+            'localhost:9123', debug_logger(), max_ops=2, max_bytes=100,
+            queue_size=1, queue_timeout=0.5)
+        admission.admit()
+        admission.start(10)
+        admission.start(10)
+        # over the op limit one request waits and the next is shed
+        waiter = eventlet.spawn(admission.admit)
+        eventlet.sleep(0)
+        self.assertEqual(len(admission.waiting), 1)
+        self.assertRaises(server.DriveBusy, admission.admit)
+        # a request coming back lets the waiter in
+        admission.finish(10)
+        waiter.wait()
+        self.assertEqual(len(admission.waiting), 0)
+        # writes count against the byte limit
+        admission.finish(10)
+        admission.start(100)
+        admission.queue_timeout = 0.01
+        self.assertRaises(server.DriveBusy, admission.admit)
+        self.assertEqual(len(admission.waiting), 0)
+        admission.finish(100)
+        admission.admit()
+        self.assertEqual(admission.shed, 2)
+        self.assertEqual(admission.logger.get_increment_counts(), {
+            'admission.queued': 2, 'admission.shed': 2})
+
+
+class TestChunkBuffer(unittest.TestCase):
+
+    def test_take(self):
+        buf = server.ChunkBuffer()
+        whole = 'a' * 10
+        buf.append(whole)
+        buf.append('')
+        buf.append('b' * 25)
+        self.assertEqual(len(buf), 35)
+        # a write that is exactly one chunk is handed back as is
+        self.assertTrue(buf.take(10) is whole)
+        # a chunk inside one write is a view of it
+        chunk = buf.take(10)
+        self.assertTrue(isinstance(chunk, memoryview))
+        self.assertEqual(chunk.tobytes(), 'b' * 10)
+        buf.append('c' * 10)
+        # a chunk that spans writes is joined together
+        self.assertEqual(buf.take(20), 'b' * 15 + 'c' * 5)
+        self.assertEqual(len(buf), 5)
+        self.assertEqual(buf.take(10), 'c' * 5)
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(buf.take(10), '')
+
+
 class TestDiskFile(KineticSwiftTestCase):
 
     def setUp(self):
@@ -65,6 +269,421 @@ class TestDiskFile(KineticSwiftTestCase):
         self.assertEqual(df.write_depth, 2)
         self.assertEqual(df.delete_depth, 4)
         self.assertEqual(df.disk_chunk_size, 2 ** 20)
+        # each op class's adaptive depth is capped by its static depth
+        self.assertEqual(df.depth_controllers['write'].max_depth, 2)
+        self.assertEqual(df.depth_controllers['delete'].max_depth, 4)
+        self.assertEqual(df.depth_controllers['read'].max_depth,
+                         server.DEFAULT_MAX_DEPTH)
+
+    def test_head_cache(self):
+        conf = {'head_cache_size': '10', 'unlink_wait': 'true'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        self.assertEqual(mgr.head_cache.max_entries, 10)
+        self.assertEqual(mgr.head_cache.ttl, server.DEFAULT_HEAD_CACHE_TTL)
+        cache = mgr.head_cache
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        body = 'awesome'
+        with df.create() as writer:
+            writer.write(body)
+            writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+
+        reads = []
+        orig_get_previous = df.conn.getPrevious
+
+        def capture_get_previous(key, *args, **kwargs):
+            reads.append(key)
+            return orig_get_previous(key, *args, **kwargs)
+
+        df.conn.getPrevious = capture_get_previous
+        for i in range(3):
+            with df.open():
+                self.assertEqual(''.join(df.reader()), body)
+            nonce = df._nonce
+        self.assertEqual(len(reads), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        # a put replaces the cached head key
+        with df.create() as writer:
+            writer.write('new body')
+            writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+        with df.open():
+            self.assertEqual(''.join(df.reader()), 'new body')
+        self.assertEqual(len(reads), 2)
+        self.assertNotEqual(df._nonce, nonce)
+
+        # so does a delete
+        df.delete(Timestamp(time.time()).internal)
+        self.assertRaises(server.diskfile.DiskFileDeleted, df.open)
+        self.assertEqual(len(reads), 3)
+        self.assertRaises(server.diskfile.DiskFileDeleted, df.open)
+        self.assertEqual(len(reads), 3)
+
+        # and a quarantine
+        df.quarantine()
+        self.assertRaises(server.diskfile.DiskFileNotExist, df.open)
+        self.assertEqual(len(reads), 4)
+
+    def test_head_cache_missing_chunks(self):
+        conf = {'head_cache_size': '10', 'disk_chunk_size': '10'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        cache = mgr.head_cache
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        with df.create() as writer:
+            writer.write('x' * 50)
+            writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+        with df.open():
+            self.assertEqual(''.join(df.reader()), 'x' * 50)
+        # the chunks go away under the cached head key
+        for key in df.keys():
+            self.client.delete(key, force=True).wait()
+        with df.open():
+            self.assertEqual(cache.hits, 1)
+            # a short body would look like a good read
+            self.assertRaises(server.diskfile.DiskFileError, ''.join,
+                              df.reader())
+        self.assertEqual(cache.get(df._head_cache_key), None)
+
+    def test_chunk_cache(self):
+        conf = {'chunk_cache_max_bytes': '100', 'disk_chunk_size': '10'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        cache = mgr.chunk_cache
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        body = ''.join(chr(97 + i) * 10 for i in range(3))
+        with df.create() as writer:
+            writer.write(body)
+            writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+
+        fetched = []
+        orig_get = df.conn.get
+
+        def capture_get(key, *args, **kwargs):
+            fetched.append(int(key.rsplit('.', 1)[1]))
+            return orig_get(key, *args, **kwargs)
+
+        df.conn.get = capture_get
+        # chunks are cached once they've been read twice
+        for i in range(3):
+            df.open()
+            self.assertEqual(''.join(df.reader()), body)
+        self.assertEqual(fetched, [1, 2, 3] * 2)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.bytes_saved, 30)
+        # ranges use the cache too
+        df.open()
+        self.assertEqual(''.join(df.reader().app_iter_range(15, 25)),
+                         body[15:25])
+        self.assertEqual(len(fetched), 6)
+
+    def test_cleanup_queue(self):
+        conf = {'cleanup_delay': '0.2', 'batch_commit': 'false'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        queue = mgr.cleanup_queue
+        name = self.buildKey('o')
+
+        def put(body, open_first=True):
+            df = mgr.get_diskfile(self.device, '0', 'a', 'c', name,
+                                  self.policy)
+            if open_first:
+                try:
+                    df.open()
+                except server.diskfile.DiskFileNotExist:
+                    pass
+            with df.create() as writer:
+                writer.write(body)
+                writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+            return df
+
+        def drain():
+            while queue.pending or queue.pool.running():
+                eventlet.sleep(0.01)
+
+        # a new object only has its temp marker to clean up
+        put('new')
+        self.assertEqual(1, len(queue))
+        self.assertEqual([False], [e['scan'] for e in queue.pending.values()])
+        drain()
+        self.assertEqual([], self.client.getKeyRange('tmp.', 'tmp/').wait())
+        # overwrites of a queued hashpath are merged into one pass
+        for i in range(3):
+            df = put('overwrite %s' % i, open_first=bool(i))
+        self.assertEqual(1, len(queue))
+        self.assertEqual(2, queue.merged)
+        drain()
+        head_keys = self.client.getKeyRange('objects', 'objects/').wait()
+        self.assertEqual(1, len(head_keys))
+        chunk_keys = self.client.getKeyRange('chunks', 'chunks/').wait()
+        self.assertEqual(1, len(chunk_keys))
+        self.assertEqual([], self.client.getKeyRange('tmp.', 'tmp/').wait())
+        df.open()
+        self.assertEqual(''.join(df.reader()), 'overwrite 2')
+
+    def test_cleanup_queue_fresh_connection(self):
+        conf = {'cleanup_delay': '0.1', 'batch_commit': 'false',
+                'connections_per_device': '1'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        queue = mgr.cleanup_queue
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        with df.create() as writer:
+            writer.write('body')
+            writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+        # only the keys are queued, not the diskfile
+        self.assertEqual([df._head_cache_key], list(queue.pending))
+        for value in queue.pending.values()[0].values():
+            self.assertFalse(isinstance(value, server.DiskFile))
+        # the writer's connection faults before the pass runs
+        df.conn.conn.faulted = True
+        while queue.pending or queue.pool.running():
+            eventlet.sleep(0.01)
+        pool = mgr.conn_pool[tuple(self.device.split(':'))]
+        self.assertFalse(df.conn in pool)
+        self.assertEqual([], self.client.getKeyRange('tmp.', 'tmp/').wait())
+        self.assertEqual([], self.logger.get_lines_for_level('error'))
+
+    def test_quarantine_copy_error(self):
+        df = self.mgr.get_diskfile(self.device, '0', 'a', 'c',
+                                   self.buildKey('o'), self.policy,
+                                   disk_chunk_size=10)
+        body = 'x' * 50
+        with df.create() as writer:
+            writer.write(body)
+            writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+        df.open()
+        broken_key = df.chunk_key(3)
+        orig_get = df.conn.get
+
+        def broken_get(key, *args, **kwargs):
+            if key == broken_key:
+                raise Exception('broken')
+            return orig_get(key, *args, **kwargs)
+
+        df.conn.get = broken_get
+        self.assertRaises(Exception, df.quarantine)
+        error_lines = self.logger.get_lines_for_level('error')
+        self.assertEqual(1, len(error_lines))
+        self.assertTrue(broken_key in error_lines[0])
+        # nothing was moved
+        self.assertEqual([], self.client.getKeyRange(
+            'quarantine', 'quarantine/').wait())
+        df.conn.get = orig_get
+        df.open()
+        self.assertEqual(''.join(df.reader()), body)
+        # the next try moves everything
+        df.quarantine()
+        self.assertEqual(6, len(self.client.getKeyRange(
+            'quarantine', 'quarantine/').wait()))
+        self.assertEqual([], self.client.getKeyRange('tmp', 'tmp/').wait())
+        self.assertRaises(server.diskfile.DiskFileNotExist, df.open)
+
+    def test_quarantine_shares_connection(self):
+        mgr = server.DiskFileManager({'connections_per_device': 1},
+                                     self.logger)
+        mgr.unlink_wait = True
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy, disk_chunk_size=10)
+        other = mgr.get_diskfile(self.device, '0', 'a', 'c',
+                                 self.buildKey('p'), self.policy,
+                                 disk_chunk_size=10)
+        self.assertTrue(df.conn is other.conn)
+        body = 'x' * 50
+        with df.create() as writer:
+            writer.write(body)
+            writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+        df.open()
+        conn = df.conn.conn
+        writers = []
+        orig_send = conn.network_send
+
+        def record_send(*args, **kwargs):
+            writers.append(eventlet.getcurrent() is conn.writer_thread)
+            return orig_send(*args, **kwargs)
+
+        conn.network_send = record_send
+        try:
+            # the head keys are swapped in a batch while another upload
+            # uses the same connection
+            quarantine = eventlet.spawn(df.quarantine)
+            with other.create() as writer:
+                writer.write('y' * 50)
+                writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+            quarantine.wait()
+        finally:
+            del conn.network_send
+        self.assertTrue(writers)
+        self.assertTrue(all(writers))
+        self.assertEqual(6, len(self.client.getKeyRange(
+            'quarantine', 'quarantine/').wait()))
+        self.assertRaises(server.diskfile.DiskFileNotExist, df.open)
+        other.open()
+        self.assertEqual(''.join(other.reader()), 'y' * 50)
+
+    def test_close_after_quarantine(self):
+        mgr = server.DiskFileManager({}, self.logger)
+        mgr.unlink_wait = True
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        with df.create() as writer:
+            writer.write('x' * 50)
+            writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+        df.open()
+        df.quarantine()
+        conn = df.conn
+        with eventlet.Timeout(5):
+            conn.close()
+        self.assertEqual(None, conn.conn)
+        self.assertEqual(2, len(self.client.getKeyRange(
+            'quarantine', 'quarantine/').wait()))
+
+    def test_static_depth_config(self):
+        conf = {'adaptive_depth': 'false'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        self.assertEqual(df.depth_controllers, {})
+        self.assertEqual(df.write_depth, server.DEFAULT_DEPTH)
+        self.assertEqual(df._depth(df.write_depth, 'write'),
+                         server.DEFAULT_DEPTH)
+
+    def test_depth_per_op_class(self):
+        mgr = server.DiskFileManager({}, self.logger)
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        controllers = df.depth_controllers
+        self.assertEqual(['delete', 'read', 'write'], sorted(controllers))
+        # a slow write only backs off the write window
+        resp = Response(df.conn, op_class='write')
+        resp.sent -= 10
+        resp.setResponse(True)
+        self.assertEqual(controllers['write'].depth, 1)
+        self.assertEqual(controllers['read'].depth, server.DEFAULT_DEPTH)
+        self.assertEqual(controllers['delete'].depth, server.DEFAULT_DEPTH)
+        self.assertEqual(df._depth(df.read_depth, 'read'),
+                         server.DEFAULT_DEPTH)
+        self.assertEqual(df._depth(df.write_depth, 'write'), 1)
+
+    def test_connection_pool(self):
+        conf = {'connections_per_device': '2'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        self.assertEqual(mgr.connections_per_device, 2)
+        conn = mgr.get_connection('localhost', self.port)
+        # idle connections are re-used
+        self.assertEqual(conn, mgr.get_connection('localhost', self.port))
+        # busy connections grow the pool
+        conn.outstanding += 1
+        other = mgr.get_connection('localhost', self.port)
+        self.assertNotEqual(conn, other)
+        # reads are coalesced across the pool
+        self.assertTrue(conn.single_flight is other.single_flight)
+        # ... up to the limit, then the least busy connection is used
+        other.outstanding += 2
+        self.assertEqual(conn, mgr.get_connection('localhost', self.port))
+        self.assertEqual(2, len(mgr.conn_pool[('localhost', self.port)]))
+        # faulted connections are replaced without dropping the rest
+        other.close()
+        replacement = mgr.get_connection('localhost', self.port)
+        self.assertNotEqual(replacement, other)
+        self.assertEqual([conn, replacement],
+                         mgr.conn_pool[('localhost', self.port)])
+
+    def test_circuit_breaker(self):
+        conf = {'breaker_threshold': '2', 'breaker_probe_interval': '0.1'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        host, port = self.device.split(':')
+        breaker = mgr.get_breaker(host, port)
+        self.stop_simulator(self.port)
+        for i in range(2):
+            self.assertRaises(server.diskfile.DiskFileDeviceUnavailable,
+                              mgr.get_connection, host, port)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        # an open breaker fails without trying to connect
+        with mock.patch.object(server, 'KineticSwiftClient') as mock_client:
+            self.assertRaises(server.diskfile.DiskFileDeviceUnavailable,
+                              mgr.get_connection, host, port)
+        self.assertFalse(mock_client.called)
+        self.start_simulator(self.port)
+        with eventlet.Timeout(5):
+            while breaker.state != breaker.CLOSED:
+                eventlet.sleep(0.05)
+        # the probe's connection went into the pool
+        pool = mgr.conn_pool[(host, port)]
+        self.assertEqual(len(pool), 1)
+        self.assertTrue(mgr.get_connection(host, port) is pool[0])
+        self.assertEqual(
+            self.logger.get_increment_counts()['circuit_breaker.rejected'], 1)
+
+    def test_admission_control(self):
+        conf = {'admission_max_ops': '1', 'admission_queue_size': '0'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c',
+                              self.buildKey('o'), self.policy)
+        admission = df.conn.admission
+        self.assertTrue(admission is mgr.get_admission(
+            *self.device.split(':')))
+        # every request on the drive's connections is counted
+        resp = df.conn.put(self.buildKey('k'), 'x' * 10)
+        self.assertEqual((admission.ops, admission.bytes), (1, 10))
+        self.assertRaises(server.DriveBusy, mgr.get_diskfile, self.device,
+                          '0', 'a', 'c', self.buildKey('o'), self.policy)
+        resp.wait()
+        self.assertEqual((admission.ops, admission.bytes), (0, 0))
+        mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                         self.policy)
+        # disabled by default
+        self.assertEqual(self.mgr.get_admission(*self.device.split(':')),
+                         None)
+
+    def test_admission_released_on_timeout(self):
+        conf = {'admission_max_ops': '1', 'admission_queue_size': '0'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c',
+                              self.buildKey('o'), self.policy)
+        conn = df.conn
+        admission = conn.admission
+        conn.response_timeout = 0.01
+        # the drive never answers
+        with mock.patch.object(conn.conn, 'putAsync'):
+            resp = conn.put(self.buildKey('k'), 'x' * 10)
+            self.assertRaises(Exception, resp.wait)
+        self.assertEqual((admission.ops, admission.bytes), (0, 0))
+        self.assertEqual(conn.outstanding, 0)
+        # the drive is admitted again
+        mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                         self.policy)
+
+    def test_close_fails_outstanding(self):
+        conf = {'admission_max_ops': '1', 'admission_queue_size': '0'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c',
+                              self.buildKey('o'), self.policy)
+        conn = df.conn
+        with mock.patch.object(conn.conn, 'getAsync'):
+            resp = conn.get(self.buildKey('k'))
+            self.assertEqual(conn.outstanding, 1)
+            conn.close()
+        self.assertRaises(Exception, resp.wait)
+        self.assertEqual(conn.outstanding, 0)
+        self.assertEqual(conn.admission.ops, 0)
+        mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                         self.policy)
+
+    def test_priority_config(self):
+        df = self.mgr.get_diskfile(self.device, '0', 'a', 'c',
+                                   self.buildKey('o'), self.policy)
+        self.assertEqual(df.conn.priority, PRIORITY_CLASSES['normal'])
+        self.assertEqual(df.cleanup_priority,
+                         PRIORITY_CLASSES['lower'])
+        conf = {'priority': 'Lowest', 'cleanup_priority': 'lowest'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c',
+                              self.buildKey('o'), self.policy)
+        self.assertEqual(df.conn.priority, PRIORITY_CLASSES['lowest'])
+        self.assertEqual(df.cleanup_priority,
+                         PRIORITY_CLASSES['lowest'])
+        self.assertRaises(ValueError, server.DiskFileManager,
+                          {'priority': 'urgent'}, self.logger)
 
     def test_config_sync_options(self):
         expectations = {
@@ -210,6 +829,264 @@ class TestDiskFile(KineticSwiftTestCase):
                                  'expected %r for metadatakey %r got %r' % (
                                      v, k, metadata[k]))
 
+    def test_group_commit(self):
+        conf = {'synchronization': 'flush', 'group_commit': 'true',
+                'group_commit_window': '0.05', 'batch_commit': 'false',
+                'unlink_wait': 'true', 'connections_per_device': '1'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        sync_options = []
+        real_put = server.KineticSwiftClient.put
+
+        def capture_put(conn, key, data, *args, **kwargs):
+            sync_options.append(kwargs.get('synchronization'))
+            return real_put(conn, key, data, *args, **kwargs)
+
+        def put(name):
+            df = mgr.get_diskfile(self.device, '0', 'a', 'c', name,
+                                  self.policy)
+            with df.create() as writer:
+                writer.write('body')
+                writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+            return df
+
+        names = [self.buildKey('o%s' % i) for i in range(3)]
+        with mock.patch.object(server.KineticSwiftClient, 'put',
+                               capture_put):
+            pool = eventlet.GreenPool()
+            dfs = list(pool.imap(put, names))
+        group_commit = mgr.get_group_commit(*self.device.split(':'))
+        # three PUTs, one flush
+        self.assertEqual(1, group_commit.flushes)
+        self.assertTrue(dfs[0].conn.group_commit is group_commit)
+        self.assertEqual(set([server.SYNC_OPTION_MAP['writeback']]),
+                         set(sync_options))
+        for name in names:
+            df = mgr.get_diskfile(self.device, '0', 'a', 'c', name,
+                                  self.policy)
+            with df.open():
+                self.assertEqual(''.join(df.reader()), 'body')
+        # only with synchronization = flush
+        conf['synchronization'] = 'writeback'
+        mgr = server.DiskFileManager(conf, self.logger)
+        self.assertEqual(None, mgr.get_group_commit(
+            *self.device.split(':')))
+
+    def test_sliced_chunks_are_tagged(self):
+        conf = {'disk_chunk_size': 10, 'batch_commit': 'false'}
+        mgr = server.DiskFileManager(conf, self.logger)
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        sent = {}
+        real_put_async = df.conn.conn.putAsync
+
+        def capture_put_async(ok, err, key, data, *args, **kwargs):
+            sent[key] = (data, kwargs)
+            return real_put_async(ok, err, key, data, *args, **kwargs)
+
+        body = ''.join(chr(ord('a') + i) * 10 for i in range(3))
+        with mock.patch.object(df.conn.conn, 'putAsync', capture_put_async):
+            with df.create() as writer:
+                # one write, every chunk is a slice of it
+                writer.write(body)
+                writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+        chunks = [(data, kwargs) for key, (data, kwargs) in sorted(
+            sent.items()) if key.startswith('chunks.')]
+        self.assertEqual(3, len(chunks))
+        for data, kwargs in chunks:
+            self.assertTrue(isinstance(data, memoryview))
+            self.assertEqual(kwargs['tag'],
+                             hashlib.sha1(data.tobytes()).digest())
+            self.assertEqual(kwargs['algorithm'],
+                             IntegrityAlgorithms.SHA1)
+        with df.open():
+            self.assertEqual(''.join(df.reader()), body)
+
+    def test_batch_put(self):
+        conf = {
+            'disk_chunk_size': 10,
+            'batch_max_ops': 4,
+            'batch_max_bytes': 30,
+        }
+        mgr = server.DiskFileManager(conf, self.logger)
+        mgr.unlink_wait = True
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        if not df.conn.supports_batch:
+            self.skipTest('kinetic client does not support batches')
+        tmp_dir = server.diskfile.get_tmp_dir(int(self.policy))
+        for size, expect_batch in ((25, True), (30, True), (31, False)):
+            puts = []
+            batches = []
+            orig_put = df.conn.put
+            orig_batch = df.conn.batch
+
+            def capture_put(key, *args, **kwargs):
+                puts.append(key)
+                return orig_put(key, *args, **kwargs)
+
+            def capture_batch(batch_puts, *args, **kwargs):
+                batches.append([key for key, value in batch_puts])
+                return orig_batch(batch_puts, *args, **kwargs)
+
+            df.conn.put = capture_put
+            df.conn.batch = capture_batch
+            expected_body = 'x' * size
+            with df.create() as writer:
+                for i in range(0, size, 7):
+                    writer.write(expected_body[i:i + 7])
+                writer.put({'X-Timestamp': time.time()})
+            del df.conn.put, df.conn.batch
+
+            if expect_batch:
+                self.assertEqual(puts, [])
+                self.assertEqual(len(batches), 1)
+                # all the chunks and then the head key
+                self.assertEqual(len(batches[0]), -(-size // 10) + 1)
+                self.assertTrue(batches[0][-1].startswith('objects'))
+            else:
+                self.assertEqual(batches, [])
+                self.assertTrue(puts[0].startswith(tmp_dir))
+            with df.open() as reader:
+                body = ''.join(reader)
+            self.assertEqual(body, expected_body)
+            keys = self.client.getKeyRange(
+                *key_range_markers(tmp_dir)).wait()
+            self.assertEqual(keys, [])
+
+    def test_batch_put_fallback(self):
+        conf = {'disk_chunk_size': 10}
+        mgr = server.DiskFileManager(conf, self.logger)
+        mgr.unlink_wait = True
+        df = mgr.get_diskfile(self.device, '0', 'a', 'c', self.buildKey('o'),
+                              self.policy)
+        if not df.conn.supports_batch:
+            self.skipTest('kinetic client does not support batches')
+        batches = []
+
+        def fail_batch(puts=(), deletes=(), **kwargs):
+            batches.append([key for key, value in puts])
+            promise = Response(df.conn)
+            promise.setError(Exception('batch aborted'))
+            return promise
+
+        expected_body = 'x' * 25
+        with mock.patch.object(df.conn, 'batch', fail_batch):
+            with df.create() as writer:
+                writer.write(expected_body)
+                writer.put({'X-Timestamp': Timestamp(time.time()).internal})
+        # the chunks and head key were streamed instead
+        self.assertEqual(1, len(batches))
+        self.assertEqual(4, len(batches[0]))
+        with df.open():
+            self.assertEqual(''.join(df.reader()), expected_body)
+        tmp_dir = server.diskfile.get_tmp_dir(int(self.policy))
+        keys = self.client.getKeyRange(*key_range_markers(tmp_dir)).wait()
+        self.assertEqual(keys, [])
+
+    def test_inline_data(self):
+        conf = {
+            'disk_chunk_size': 10,
+            'inline_max_bytes': 15,
+            'batch_commit': 'false',
+        }
+        mgr = server.DiskFileManager(conf, self.logger)
+        mgr.unlink_wait = True
+        # objects up to inline_max_bytes are only a head key
+        for size, expected_chunks in ((0, 0), (7, 0), (15, 0), (16, 1),
+                                      (42, 3)):
+            df = mgr.get_diskfile(self.device, '0', 'a', 'c',
+                                  self.buildKey('o%s' % size), self.policy)
+            expected_body = ''.join(chr(97 + i % 26) for i in range(size))
+            with df.create() as writer:
+                for i in range(0, size, 4):
+                    writer.write(expected_body[i:i + 4])
+                writer.put({'X-Timestamp': time.time()})
+            keys = self.client.getKeyRange(
+                *key_range_markers('chunks.%s' % df.hashpath)).wait()
+            self.assertEqual(expected_chunks, len(keys))
+
+            with df.open() as reader:
+                metadata = reader.get_metadata()
+                body = ''.join(reader)
+            self.assertEqual(body, expected_body)
+            self.assertEqual(metadata['X-Kinetic-Chunk-Count'],
+                             expected_chunks)
+            self.assertFalse(server.INLINE_DATA_KEY in metadata)
+
+            # ranges across the inline data and chunks
+            for start, stop in ((0, 3), (3, 15), (14, 16), (15, 16),
+                                (12, 37), (25, 42), (0, size)):
+                if stop > size:
+                    continue
+                df.open()
+                body = ''.join(df.reader().app_iter_range(start, stop))
+                self.assertEqual(body, expected_body[start:stop],
+                                 'wrong body for %r-%r' % (start, stop))
+
+        # quarantine moves the head key, and its inline data, with the chunks
+        with df.open():
+            nonce = df._nonce
+            df.quarantine()
+        keys = [k for k in self.client.getKeyRange(
+            *key_range_markers('quarantine')).wait() if nonce in k]
+        self.assertEqual(len(keys), 4)
+
+    def test_range_reads_only_needed_chunks(self):
+        df = self.mgr.get_diskfile(self.device, '0', 'a', 'c',
+                                   self.buildKey('o'), self.policy,
+                                   disk_chunk_size=10)
+        expected_body = ''.join(chr(97 + i) * 10 for i in range(10))
+        with df.create() as writer:
+            writer.write(expected_body)
+            writer.put({'X-Timestamp': time.time()})
+
+        fetched = []
+        orig_get = df.conn.get
+
+        def capture_get(key, *args, **kwargs):
+            fetched.append(int(key.rsplit('.', 1)[1]))
+            return orig_get(key, *args, **kwargs)
+
+        df.conn.get = capture_get
+        df.open()
+        self.assertEqual(df.plan_range(25, 37), [(2, 5, None), (3, 0, 7)])
+        self.assertEqual(df.plan_range(90, None), [(9, 0, None)])
+        self.assertEqual(df.plan_range(95, 200), [(9, 5, None)])
+        self.assertEqual(df.plan_range(5, 5), [])
+        body = ''.join(df.reader().app_iter_range(25, 37))
+        self.assertEqual(body, expected_body[25:37])
+        self.assertEqual(fetched, [3, 4])
+
+        # overlapping ranges share their chunks
+        fetched[:] = []
+        ranges = [(5, 15), (12, 25), (0, 3), (95, 100)]
+        df.open()
+        reader = df.reader()
+        bodies = [''.join(it) for it in reader._iter_ranges(ranges)]
+        self.assertEqual(bodies, [expected_body[start:stop]
+                                  for start, stop in ranges])
+        self.assertEqual(fetched, [1, 2, 3, 10])
+
+    def test_reader_hands_out_str(self):
+        df = self.mgr.get_diskfile(self.device, '0', 'a', 'c',
+                                   self.buildKey('o'), self.policy,
+                                   disk_chunk_size=10)
+        expected_body = ''.join(chr(97 + i) * 10 for i in range(3))
+        with df.create() as writer:
+            writer.write(expected_body)
+            writer.put({'X-Timestamp': time.time()})
+
+        # the chunks are passed along as the client read them ...
+        df.open()
+        self.assertEqual(len(list(df)), 3)
+        # ... and only copied into a str on the way out of the reader
+        for chunks in (df.reader(), df.reader().app_iter_range(5, 25)):
+            df.open()
+            for chunk in chunks:
+                self.assertTrue(isinstance(chunk, str))
+        self.assertEqual(server.to_str(bytearray('abcdef'), 1, 3), 'bc')
+        self.assertEqual(server.to_str('abcdef', 4), 'ef')
+
     def test_get_not_found(self):
         df = self.mgr.get_diskfile(self.device, '0', 'a', 'c',
                                    self.buildKey('o'), self.policy)
@@ -132,6 +132,43 @@ class TestUtilFunctions(unittest.TestCase):
                     self.fail(msg)
 
 
+class TestPartitionNodeCache(unittest.TestCase):
+
+    def test_memoized_until_ring_reloads(self):
+        class FakeRing(object):
+            _part_shift = 30
+            _replica2part2dev_id = [[0, 1, 2, 0], [1, 2, 0, 1]]
+            get_part_nodes = mock.MagicMock(side_effect=lambda part: [
+                {'device': 'd%s' % replica[part], 'index': i}
+                for i, replica in enumerate(
+                    FakeRing._replica2part2dev_id)])
+
+        ring = FakeRing()
+        cache = replicator.PartitionNodeCache(ring)
+        # part 2
+        hashpath = '8%031x' % 1
+        part, targets, delete = cache.get_targets('d2', hashpath, None,
+                                                  False)
+        self.assertEqual(part, 2)
+        self.assertEqual(targets, [{'device': 'd0', 'index': 1}])
+        self.assertFalse(delete)
+        self.assertEqual(cache.get_targets('d1', '8%031x' % 2, None, False),
+                         (2, ring.get_part_nodes(2), True))
+        ring.get_part_nodes.reset_mock()
+        for i in range(10):
+            cache.get_targets('d2', '8%031x' % i, None, False)
+            cache.get_part_nodes(2)
+        self.assertFalse(ring.get_part_nodes.called)
+        # a new ring is picked up on the next check
+        FakeRing._replica2part2dev_id = [[0, 1, 1, 0], [1, 2, 0, 1]]
+        cache.next_check = 0
+        part, targets, delete = cache.get_targets('d2', hashpath, None,
+                                                  False)
+        self.assertEqual(targets, [{'device': 'd1', 'index': 0},
+                                   {'device': 'd0', 'index': 1}])
+        self.assertTrue(delete)
+
+
 @utils.patch_policies(with_ec_default=False)
 class TestKineticReplicator(utils.KineticSwiftTestCase):
 
@@ -212,6 +249,69 @@ class TestKineticReplicator(utils.KineticSwiftTestCase):
             keys = list(self.daemon.iter_all_objects(conn, policy))
             self.assertEqual(1, len(keys))
 
+    def test_iter_all_objects_scan_connections(self):
+        port = self.ports[0]
+        dev = '127.0.0.1:%s' % port
+        for i in range(20):
+            self.put_object(dev, 'obj-%s' % i, policy=self.policy)
+        conn = self.client_map[port]
+        self.daemon.scan_shards = 16
+        self.daemon.scan_concurrency = 3
+        scan_conns = []
+        orig_get_conn = self.daemon._get_conn
+
+        def capture_get_conn(device):
+            scan_conn = orig_get_conn(device)
+            scan_conns.append(scan_conn)
+            return scan_conn
+
+        with mock.patch.object(conn, 'iterKeyRange') as mock_iter, \
+                mock.patch.object(self.daemon, '_get_conn',
+                                  capture_get_conn):
+            keys = list(self.daemon.iter_all_objects(conn, self.policy))
+        self.assertEqual(20, len(keys))
+        # the sub-ranges are scanned on their own connections
+        self.assertFalse(mock_iter.called)
+        self.assertTrue(1 <= len(scan_conns) <= 3)
+        self.assertEqual(len(scan_conns), len(set(scan_conns)))
+        for scan_conn in scan_conns:
+            self.assertFalse(scan_conn.isConnected)
+
+    def test_scan_connections_count_against_max_connections(self):
+        port = self.ports[0]
+        dev = '127.0.0.1:%s' % port
+        for i in range(20):
+            self.put_object(dev, 'obj-%s' % i, policy=self.policy)
+        conn = self.client_map[port]
+        self.daemon.scan_shards = 16
+        self.daemon.scan_concurrency = 3
+        self.daemon.max_connections = 2
+        idle_conn = mock.MagicMock(outstanding=0)
+        self.daemon._conn_pool['127.0.0.1:1'] = (0, idle_conn)
+        counts = []
+        orig_get_conn = self.daemon._get_conn
+
+        def capture_get_conn(device):
+            counts.append(self.daemon._connection_count())
+            return orig_get_conn(device)
+
+        with mock.patch.object(self.daemon, '_get_conn', capture_get_conn):
+            keys = list(self.daemon.iter_all_objects(conn, self.policy))
+        self.assertEqual(20, len(keys))
+        # the idle connection made room for a second scan connection, and
+        # the third sub-range shared one of them
+        idle_conn.close.assert_called_once_with()
+        self.assertEqual({}, self.daemon._conn_pool)
+        self.assertEqual([2, 2], counts)
+        self.assertEqual(0, self.daemon._connection_count())
+
+        # without any room the scan falls back to the device's connection
+        self.daemon.max_connections = 0
+        with mock.patch.object(self.daemon, '_get_conn') as mock_get_conn:
+            keys = list(self.daemon.iter_all_objects(conn, self.policy))
+        self.assertEqual(20, len(keys))
+        self.assertFalse(mock_get_conn.called)
+
     def test_iter_lots_of_objects(self):
         port = self.ports[0]
         dev = '127.0.0.1:%s' % port
@@ -302,6 +402,8 @@ class TestKineticReplicator(utils.KineticSwiftTestCase):
                          self.policy.object_ring.replica_count)
 
     def test_cleanup_aborted_uploads(self):
+        # small uploads are committed atomically, make sure these stream
+        self.mgr.batch_commit = False
         port = random.choice(self.ports)
         conn = self.client_map[port]
         dev = '127.0.0.1:%s' % port
@@ -386,6 +488,8 @@ class TestKineticReplicator(utils.KineticSwiftTestCase):
             self.assertEqual(count, len(keys), msg)
 
     def test_cleanup_orphaned_temp_markers(self):
+        # small uploads are committed atomically, make sure these stream
+        self.mgr.batch_commit = False
         # use the first primary to keep the object from being replicated off
         port = self.ports[0]
         conn = self.client_map[port]
@@ -476,6 +580,153 @@ class TestKineticReplicator(utils.KineticSwiftTestCase):
         self.assertRaises(server.diskfile.DiskFileNotExist, self.get_object,
                           other_device, 'obj1')
 
+    def test_get_conn_concurrent(self):
+        device = '127.0.0.1:%s' % self.ports[0]
+        orig_get_conn = self.daemon._get_conn
+        created = []
+
+        def slow_get_conn(device):
+            eventlet.sleep(0.01)
+            conn = orig_get_conn(device)
+            created.append(conn)
+            return conn
+
+        with mock.patch.object(self.daemon, '_get_conn', slow_get_conn):
+            pool = eventlet.GreenPool()
+            conns = list(pool.imap(self.daemon.get_conn, [device] * 3))
+        # every job gets the pooled connection, the extras are closed
+        self.assertEqual(1, len(set(conns)))
+        self.assertEqual(3, len(created))
+        self.assertEqual([conns[0]], [c for c in created if c.isConnected])
+        self.assertEqual(conns[0], self.daemon._conn_pool[device][1])
+
+    def test_replicate_workers_stats(self):
+        source_device = '127.0.0.1:%s' % self.ports[0]
+        for policy in server.diskfile.POLICIES:
+            self.put_object(source_device, 'obj1', policy=policy)
+        self.daemon.replicator_workers = 2
+        self.daemon.replicate(override_devices=[source_device])
+        # the worker that replicated the device sent its stats back
+        stats = self.daemon.device_stats[source_device]
+        self.assertEqual(stats['objects'], 1)
+        self.assertEqual(stats['failures'], 0)
+        self.assertTrue('elapsed' in stats)
+
+    def test_replicate_workers_split_max_connections(self):
+        self.daemon.max_connections = 10
+        self.daemon.replicator_workers = 3
+        self.daemon._conn_pool['127.0.0.1:1'] = (0, mock.MagicMock())
+
+        def record_budget(override_devices, worker, workers):
+            self.daemon.device_stats['worker-%s' % worker] = {
+                'max_connections': self.daemon.max_connections,
+                'connections': self.daemon._connection_count(),
+            }
+
+        with mock.patch.object(self.daemon, '_replicate_policies',
+                               record_budget):
+            self.daemon.replicate()
+        # each worker starts without the parent's connections and gets a
+        # share of the budget for its pooled and scan connections
+        for worker in range(3):
+            self.assertEqual(
+                {'max_connections': 3, 'connections': 0},
+                self.daemon.device_stats['worker-%s' % worker])
+        self.assertEqual(10, self.daemon.max_connections)
+
+    def test_replicate_device_stats(self):
+        source_device = '127.0.0.1:%s' % self.ports[0]
+        target_device = '127.0.0.1:%s' % self.ports[1]
+        self.assertEqual(self.daemon.object_concurrency,
+                         replicator.DEFAULT_OBJECT_CONCURRENCY)
+        self.assertEqual(self.daemon.replicator_workers, 1)
+        expected = self.put_object(source_device, 'obj1')
+        self.daemon._replicate(source_device, policy=self.policy)
+        self.assertEquals(expected, self.get_object(target_device, 'obj1'))
+        stats = self.daemon.device_stats[source_device]
+        self.assertEqual(stats['objects'], 1)
+        self.assertEqual(stats['replicated'], 1)
+        self.assertEqual(stats['in_sync'], 0)
+        self.assertEqual(stats['failures'], 0)
+        self.assertTrue('elapsed' in stats)
+        self.assertFalse(self.daemon._replicating)
+        # a second pass finds it in sync
+        self.daemon._replicate(source_device, policy=self.policy)
+        stats = self.daemon.device_stats[source_device]
+        self.assertEqual(stats['objects'], 1)
+        self.assertEqual(stats['replicated'], 0)
+        self.assertEqual(stats['in_sync'], 1)
+
+    def test_replicate_partition_diff(self):
+        self.daemon.partition_diff = True
+        source_device = '127.0.0.1:%s' % self.ports[0]
+        target_device = '127.0.0.1:%s' % self.ports[1]
+        expected = self.put_object(source_device, 'obj1')
+        with mock.patch.object(self.daemon, 'is_object_on_target') as probe:
+            self.daemon._replicate(source_device, policy=self.policy)
+            self.assertEquals(expected,
+                              self.get_object(target_device, 'obj1'))
+            stats = self.daemon.device_stats[source_device]
+            self.assertEqual(stats['replicated'], 1)
+            # a newer version on the source is pushed again
+            expected = self.put_object(source_device, 'obj1')
+            self.daemon._replicate(source_device, policy=self.policy)
+            self.assertEquals(expected,
+                              self.get_object(target_device, 'obj1'))
+            stats = self.daemon.device_stats[source_device]
+            self.assertEqual(stats['replicated'], 1)
+            # and then it's in sync
+            self.daemon._replicate(source_device, policy=self.policy)
+            stats = self.daemon.device_stats[source_device]
+            self.assertEqual(stats['replicated'], 0)
+            self.assertEqual(stats['in_sync'], 1)
+        self.assertFalse(probe.called)
+
+    def test_replicate_partition_summaries(self):
+        self.daemon.partition_summaries = True
+        source_device = '127.0.0.1:%s' % self.ports[0]
+        target_device = '127.0.0.1:%s' % self.ports[1]
+        expected = self.put_object(source_device, 'obj1')
+        self.daemon._replicate(source_device, policy=self.policy)
+        self.assertEquals(expected, self.get_object(target_device, 'obj1'))
+        stats = self.daemon.device_stats[source_device]
+        self.assertEqual(stats['replicated'], 1)
+        self.assertEqual(stats['partitions_skipped'], 0)
+        # once the target has summarized the partition it's skipped
+        self.daemon._replicate(target_device, policy=self.policy)
+        with mock.patch.object(self.daemon, 'is_object_on_target') as probe:
+            self.daemon._replicate(source_device, policy=self.policy)
+        self.assertFalse(probe.called)
+        stats = self.daemon.device_stats[source_device]
+        self.assertEqual(stats['partitions_skipped'], 1)
+        self.assertEqual(stats['in_sync'], 1)
+        # until it changes
+        expected = self.put_object(source_device, 'obj1')
+        self.daemon._replicate(source_device, policy=self.policy)
+        self.assertEquals(expected, self.get_object(target_device, 'obj1'))
+        stats = self.daemon.device_stats[source_device]
+        self.assertEqual(stats['replicated'], 1)
+        self.assertEqual(stats['partitions_skipped'], 0)
+
+    def test_resume_pass_from_checkpoint(self):
+        self.daemon.max_pass_keys = 1
+        source_device = '127.0.0.1:%s' % self.ports[0]
+        self.put_object(source_device, 'obj1')
+        self.put_object(source_device, 'obj2')
+        self.daemon._replicate(source_device, policy=self.policy)
+        self.assertEqual(self.daemon.device_stats[source_device]['objects'],
+                         1)
+        checkpoint = self.daemon.load_checkpoint(source_device, self.policy)
+        self.assertTrue(checkpoint)
+        # the next pass picks up after the checkpoint and finishes
+        with mock.patch.object(self.daemon, 'replicate_object') as mock_ro:
+            self.daemon._replicate(source_device, policy=self.policy)
+        self.assertEqual(1, mock_ro.call_count)
+        job = mock_ro.call_args[0][1]
+        self.assertTrue(job['key'] < checkpoint)
+        self.assertEqual(
+            None, self.daemon.load_checkpoint(source_device, self.policy))
+
     def test_replicate_random_chunks(self):
         object_ring = self.policy.object_ring
         _part, devices = object_ring.get_nodes('a', 'c', 'random_object')
@@ -403,6 +403,9 @@ class TestSpawnedKineticServer(KineticSwiftTestCase):
 
     def test_put_disconnect(self):
         num_chunks = 10
+        # small uploads are committed atomically, make sure this one streams
+        for policy in POLICIES:
+            self.app._diskfile_router[policy].batch_commit = False
 
         # PUT
         headers = {